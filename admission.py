@@ -0,0 +1,301 @@
+"""
+Admission Control
+
+This module provides an ASGI middleware capping the number of requests the
+worker handles at once. Requests over the cap wait in a bounded queue for
+at most a queue timeout, and are shed with a fast `503 Service Unavailable`
+(with a `Retry-After` header) when the queue is full or the wait is too
+long, instead of piling up behind MongoDB.
+
+Waiting requests are admitted by priority: cheap public reads, which are
+mostly served from the caches, go before mutations and CC (admin) reads,
+which scan the collection. The body is read to classify a request before
+it is admitted, so bodies over `MAX_BODY_BYTES` are rejected with a
+`413 Content Too Large` rather than buffered.
+
+Attributes:
+    MAX_IN_FLIGHT (int): Max requests handled at once. Defaults to 64.
+    MAX_QUEUED (int): Max requests waiting to be admitted. Defaults to 256.
+    QUEUE_TIMEOUT (float): Max seconds a request waits to be admitted.
+                           Defaults to 2.
+    RETRY_AFTER (int): Seconds clients are asked to wait before retrying a
+                       shed request. Defaults to 1.
+    MAX_BODY_BYTES (int): Max size of the body of a request in bytes.
+                          Defaults to 2 MiB.
+    UNLIMITED_PATHS (set): Paths that are never queued nor shed.
+"""
+
+import asyncio
+import json
+from collections import deque
+from os import getenv
+
+from graphql import GraphQLError
+from graphql.language import Lexer, Source, TokenKind
+
+MAX_IN_FLIGHT = int(getenv("MAX_IN_FLIGHT", "64"))
+MAX_QUEUED = int(getenv("MAX_QUEUED", "256"))
+QUEUE_TIMEOUT = float(getenv("QUEUE_TIMEOUT", "2"))
+RETRY_AFTER = int(getenv("RETRY_AFTER", "1"))
+MAX_BODY_BYTES = int(getenv("MAX_BODY_BYTES", str(2 * 1024**2)))
+UNLIMITED_PATHS = {"/healthz", "/readyz", "/metrics"}
+
+# priorities, lower is admitted first
+PRIORITY_READ = 0
+PRIORITY_HEAVY = 1
+
+
+class AdmissionController:
+    """
+    Caps the requests in flight, admitting waiting ones by priority.
+
+    Attributes:
+        max_in_flight (int): Max requests handled at once.
+        max_queued (int): Max requests waiting to be admitted.
+        queue_timeout (float): Max seconds a request waits to be admitted.
+        in_flight (int): Requests being handled.
+        admitted (int): Number of requests admitted.
+        shed (int): Number of requests rejected.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_queued: int = MAX_QUEUED,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._waiters = (deque(), deque())
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters)
+
+    async def acquire(self, priority: int) -> bool:
+        """
+        Waits for a slot for a request.
+
+        Args:
+            priority (int): Priority of the request, lower goes first.
+
+        Returns:
+            (bool): True if admitted, False if the request is to be shed.
+        """
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+        if self.queued >= self.max_queued:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(priority, waiter)
+            self.shed += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before cancellation
+                self.release()
+            else:
+                self._discard(priority, waiter)
+            raise
+
+        self.admitted += 1
+        return True
+
+    def _discard(self, priority: int, waiter: asyncio.Future):
+        try:
+            self._waiters[priority].remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        """
+        Frees the slot of a finished request, handing it over to the next
+        waiting request if any.
+        """
+        for waiters in self._waiters:
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    # the slot goes straight to the waiter
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        """
+        Returns the current load and counters of the controller.
+        """
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+admission_controller = AdmissionController()
+
+
+def _is_mutation(query: str) -> bool:
+    """
+    Whether a GraphQL document defines a mutation, those that don't lex
+    counting as one.
+
+    Only the tokens are scanned, cheaper than a full parse: a definition
+    starts the document or follows the closing brace of the previous one,
+    so `mutation` in that place, outside any braces or parentheses, is an
+    operation type and not a field, argument or type name.
+    """
+    lexer = Lexer(Source(query))
+    depth = 0
+    definition_start = True
+    try:
+        token = lexer.advance()
+        while token.kind != TokenKind.EOF:
+            if token.kind in (TokenKind.BRACE_L, TokenKind.PAREN_L):
+                depth += 1
+            elif token.kind in (TokenKind.BRACE_R, TokenKind.PAREN_R):
+                depth -= 1
+            elif (
+                definition_start
+                and token.kind == TokenKind.NAME
+                and token.value == "mutation"
+            ):
+                return True
+            definition_start = depth == 0 and token.kind == TokenKind.BRACE_R
+            token = lexer.advance()
+    except GraphQLError:
+        return True
+    return False
+
+
+def _request_priority(scope, body: bytes) -> int:
+    """
+    Classifies a request as a cheap read or a heavy operation, i.e. a
+    mutation or a CC read of all clubs (which isn't cached).
+    """
+    if scope["method"] == "GET":
+        return PRIORITY_READ
+
+    try:
+        payload = json.loads(body)
+        user = json.loads(dict(scope["headers"]).get(b"user", b"{}"))
+    except ValueError:
+        return PRIORITY_HEAVY
+    is_admin = isinstance(user, dict) and user.get("role") in ["cc"]
+
+    operations = payload if isinstance(payload, list) else [payload]
+    for operation in operations:
+        if not isinstance(operation, dict):
+            return PRIORITY_HEAVY
+        # classified on the document's tokens, mutations possibly following
+        # comments or fragments
+        query = str(operation.get("query", ""))
+        if (is_admin and "allClubs" in query) or _is_mutation(query):
+            return PRIORITY_HEAVY
+    return PRIORITY_READ
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting HTTP requests through an AdmissionController.
+    """
+
+    def __init__(self, app, controller: AdmissionController = None):
+        self.app = app
+        self.controller = controller or admission_controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # GraphQL requests are small, so the body is read up front to
+        # classify the request, and replayed to the app
+        try:
+            length = int(dict(scope["headers"]).get(b"content-length", 0))
+        except ValueError:
+            length = 0
+        if length > MAX_BODY_BYTES:
+            await self._reject_too_large(send)
+            return
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                await self._reject_too_large(send)
+                return
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        if not await self.controller.acquire(_request_priority(scope, body)):
+            await self._shed(send)
+            return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body}
+            return await receive()
+
+        try:
+            await self.app(scope, replay, send)
+        finally:
+            self.controller.release()
+
+    async def _reject_too_large(self, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b'{"detail":"Request body too large"}',
+            }
+        )
+
+    async def _shed(self, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(RETRY_AFTER).encode()),
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b'{"detail":"Service overloaded, retry later"}',
+            }
+        )
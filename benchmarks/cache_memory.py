@@ -0,0 +1,93 @@
+"""
+Benchmark of the memory used by cached clubs.
+
+Measures, with tracemalloc, the memory retained per 1,000 cached clubs when
+they are kept as Strawberry `FullClubType` objects and as compact
+`ClubRecord`s.
+
+Usage (from the repository root):
+    python -m benchmarks.cache_memory --clubs 1000
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from cache import deep_sizeof
+from models import Club
+from otypes import FullClubType
+from records import ClubRecord
+
+CATEGORIES = ["cultural", "technical", "affinity", "admin", "body", "other"]
+
+
+def generate_clubs(count: int) -> list[dict]:
+    """
+    Generates club documents the way they come out of MongoDB, with every
+    document holding its own copy of every string.
+    """
+    clubs = []
+    for i in range(count):
+        clubs.append(
+            {
+                "cid": f"club{i}",
+                "code": f"c{i}",
+                "state": "active",
+                "category": CATEGORIES[i % len(CATEGORIES)],
+                "name": f"The Club Number {i}",
+                "email": f"club{i}@students.iiit.ac.in",
+                "logo": f"/files/static?filename=logo{i}.png",
+                "banner": f"/files/static?filename=banner{i}.png",
+                "tagline": "A club of the IIIT Hyderabad community",
+                "description": "Lorem ipsum dolor sit amet. " * 20,
+                "socials": {
+                    "website": "https://clubs.iiit.ac.in/",
+                    "instagram": f"https://instagram.com/club{i}",
+                    "discord": "https://discord.gg/iiit",
+                    "other_links": ["https://github.com/iiit"],
+                },
+            }
+        )
+    # round trip through JSON so that no strings are shared between clubs
+    return json.loads(json.dumps(clubs))
+
+
+def measure(docs: list[dict], build) -> dict:
+    """
+    Measures the memory retained by the cached representation of the docs.
+    """
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    cached = [build(Club.model_validate(doc)) for doc in docs]
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_thousand = (current - baseline) * 1000 / len(docs)
+    return {
+        "retained_bytes_per_1000": round(per_thousand),
+        "peak_bytes": peak - baseline,
+        "deep_sizeof_per_1000": round(deep_sizeof(cached) * 1000 / len(docs)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clubs", type=int, default=1000)
+    args = parser.parse_args()
+
+    docs = generate_clubs(args.clubs)
+    results = {
+        "clubs": args.clubs,
+        "full_club_type": measure(docs, FullClubType.from_pydantic),
+        "club_record": measure(generate_clubs(args.clubs), ClubRecord),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
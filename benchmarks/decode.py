@@ -0,0 +1,170 @@
+"""
+Decoding benchmark of the club list read path.
+
+Compares, for the documents of a club list read on a cache miss:
+
+- `dict`: decoding whole documents into dicts, validating them into `Club`
+  and building the records from it, as `allClubs` used to.
+- `dict_projected`: decoding documents restricted to `LIST_PROJECTION`
+  into dicts and building the records straight from them, as `allClubs`
+  does.
+- `raw`: reading documents restricted to `LIST_PROJECTION` as
+  `RawBSONDocument`s, decoded lazily, and building the records straight
+  from them.
+
+For every path, the time to build the records and the memory allocated
+while doing so (peak, as traced by tracemalloc) are measured. The time to
+serve a cached list from its records is compared to serving it from the raw
+bytes kept in the cache instead, along with the size of both.
+
+The documents are encoded to BSON up front, standing in for the replies of
+the server. The results are written as JSON, along with the commit and
+configuration, so that runs can be compared across commits.
+
+Usage (from the repository root):
+    python -m benchmarks.decode --clubs 500 --repeat 20 --output decode.json
+"""
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+from benchmarks.load import club_document, current_commit
+from cache import deep_sizeof
+from models import Club, create_utc_time
+from records import LIST_PROJECTION, ClubRecord
+
+
+def encoded_documents(clubs: int) -> tuple[list[bytes], list[bytes]]:
+    """
+    Returns the BSON of the full documents of the clubs, without their
+    `_id` as read by public queries, and of the ones restricted to
+    `LIST_PROJECTION`.
+    """
+    full, projected = [], []
+    for i in range(clubs):
+        doc = {
+            "created_time": create_utc_time(),
+            "updated_time": create_utc_time(),
+            "version": 1,
+            **club_document(i),
+        }
+        full.append(bson.encode(doc))
+        projected.append(
+            bson.encode(
+                {key: doc[key] for key in LIST_PROJECTION if key in doc}
+            )
+        )
+    return full, projected
+
+
+def build_dict(documents: list[bytes]) -> tuple:
+    return tuple(
+        ClubRecord(Club.model_validate(bson.decode(data)))
+        for data in documents
+    )
+
+
+def build_dict_projected(documents: list[bytes]) -> tuple:
+    return tuple(
+        ClubRecord.from_document(bson.decode(data)) for data in documents
+    )
+
+
+def build_raw(documents: list[bytes]) -> tuple:
+    return tuple(
+        ClubRecord.from_document(RawBSONDocument(data)) for data in documents
+    )
+
+
+def serve_records(records: tuple) -> list:
+    return [record.to_simple_type() for record in records]
+
+
+def serve_raw_bytes(documents: list[bytes]) -> list:
+    return serve_records(build_raw(documents))
+
+
+def timed(function, argument, repeat: int) -> dict:
+    """
+    Runs `function(argument)` `repeat` times.
+
+    Returns:
+        (dict): The best and mean time in ms, and the peak memory allocated
+                by one run in KiB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "best_ms": round(min(times) * 1000, 3),
+        "mean_ms": round(sum(times) / len(times) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def benchmark(args) -> dict:
+    full, projected = encoded_documents(args.clubs)
+    records = build_dict_projected(projected)
+
+    results = {
+        "build": {
+            "dict": timed(build_dict, full, args.repeat),
+            "dict_projected": timed(
+                build_dict_projected, projected, args.repeat
+            ),
+            "raw": timed(build_raw, projected, args.repeat),
+        },
+        "serve": {
+            "records": timed(serve_records, records, args.repeat),
+            "raw_bytes": timed(serve_raw_bytes, projected, args.repeat),
+        },
+        "cache_bytes": {
+            "records": deep_sizeof(records),
+            "records_of_full_documents": deep_sizeof(build_dict(full)),
+            "raw_bytes": deep_sizeof(projected),
+        },
+        "bson_bytes": {
+            "full": sum(map(len, full)),
+            "projected": sum(map(len, projected)),
+        },
+    }
+
+    return {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "config": {"clubs": args.clubs, "repeat": args.repeat},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clubs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="File the JSON results go to")
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Load and latency benchmark of the GraphQL API.
+
+Runs the FastAPI app in-process against an in-memory MongoDB stand-in and
+stub gateway and files microservices (served over HTTP on localhost and
+reached through `GATEWAY_URL` and `FILES_URL`), seeds it with clubs, and
+measures the throughput and the p50/p95/p99 latencies of:
+
+- public and admin `allClubs`,
+- cached and uncached `club`,
+- `createClub`, `editClub` and `deleteClub`.
+
+The results are written as JSON, along with the commit and configuration,
+so that runs can be compared across commits.
+
+Usage (from the repository root):
+    python -m benchmarks.load --clubs 500 --requests 2000 --concurrency 16 \
+        --output results.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+
+from benchmarks.standins import (
+    MemoryCollection,
+    files_app,
+    free_port,
+    gateway_app,
+    serving,
+)
+
+CATEGORIES = ["cultural", "technical", "affinity", "admin", "body", "other"]
+PUBLIC_USER = {"uid": None, "role": "public"}
+CC_USER = {"uid": "cc", "role": "cc"}
+
+CLUB_FIELDS = "cid code name category state tagline"
+FULL_CLUB_FIELDS = (
+    "cid code name category state email logo banner tagline description "
+    "socials { website instagram discord otherLinks }"
+)
+
+
+def club_document(i: int) -> dict:
+    return {
+        "cid": f"club{i}",
+        "code": f"c{i}",
+        "state": "active",
+        "category": CATEGORIES[i % len(CATEGORIES)],
+        "name": f"The Club Number {i}",
+        "email": f"club{i}@students.iiit.ac.in",
+        "logo": f"/files/static?filename=logo{i}.png",
+        "banner": f"/files/static?filename=banner{i}.png",
+        "tagline": "A club of the IIIT Hyderabad community",
+        "description": "Lorem ipsum dolor sit amet. " * 20,
+        "socials": {
+            "website": "https://clubs.iiit.ac.in/",
+            "instagram": f"https://instagram.com/club{i}",
+            "discord": "https://discord.gg/iiit",
+            "other_links": ["https://github.com/iiit"],
+        },
+    }
+
+
+def club_input(doc: dict, **changes) -> dict:
+    """Turns a club document into a `FullClubInput`."""
+    socials = doc["socials"]
+    return {
+        "cid": doc["cid"],
+        "code": doc["code"],
+        "name": doc["name"],
+        "email": doc["email"],
+        "category": doc["category"],
+        "logo": doc["logo"],
+        "banner": doc["banner"],
+        "tagline": doc["tagline"],
+        "description": doc["description"],
+        "socials": {
+            "website": socials["website"],
+            "instagram": socials["instagram"],
+            "discord": socials["discord"],
+            "otherLinks": socials["other_links"],
+        },
+        **changes,
+    }
+
+
+def percentile(latencies: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    rank = max(0, min(len(latencies) - 1, round(p / 100 * len(latencies)) - 1))
+    return latencies[rank]
+
+
+def scenarios(clubs: int) -> dict:
+    """
+    Builds the scenarios to be run, each a function returning the query,
+    variables and user of its n-th request. Uncached `club` lookups drop
+    the club from the cache when building the request, outside of the
+    timing.
+    """
+    from utils import club_cache
+
+    created = itertools.count()
+
+    def all_clubs_public(n):
+        return f"{{ allClubs {{ {CLUB_FIELDS} }} }}", {}, PUBLIC_USER
+
+    def all_clubs_admin(n):
+        return f"{{ allClubs {{ {CLUB_FIELDS} }} }}", {}, CC_USER
+
+    club_query = (
+        "query Club($cid: String!) { club(clubInput: {cid: $cid}) "
+        f"{{ {FULL_CLUB_FIELDS} }} }}"
+    )
+
+    def club_cached(n):
+        return club_query, {"cid": "club0"}, PUBLIC_USER
+
+    def club_uncached(n):
+        cid = f"club{n % clubs}"
+        club_cache.pop(cid, None)
+        return club_query, {"cid": cid}, PUBLIC_USER
+
+    def create_club(n):
+        i = clubs + next(created)
+        doc = club_document(i)
+        doc.update(
+            cid=f"new{i}", code=f"n{i}", email=f"new{i}@students.iiit.ac.in"
+        )
+        return (
+            "mutation Create($club: FullClubInput!) "
+            f"{{ createClub(clubInput: $club) {{ {CLUB_FIELDS} }} }}",
+            {"club": club_input(doc)},
+            CC_USER,
+        )
+
+    def edit_club(n):
+        doc = club_document(n % clubs)
+        return (
+            "mutation Edit($club: FullClubInput!) "
+            f"{{ editClub(clubInput: $club) {{ {FULL_CLUB_FIELDS} }} }}",
+            {"club": club_input(doc, tagline=f"Edited {n} times")},
+            CC_USER,
+        )
+
+    def delete_club(n):
+        return (
+            "mutation Delete($cid: String!) "
+            f"{{ deleteClub(clubInput: {{cid: $cid}}) {{ {CLUB_FIELDS} }} }}",
+            {"cid": f"club{clubs - 1 - n % clubs}"},
+            CC_USER,
+        )
+
+    return {
+        "allClubs_public": all_clubs_public,
+        "allClubs_admin": all_clubs_admin,
+        "club_cached": club_cached,
+        "club_uncached": club_uncached,
+        "createClub": create_club,
+        "editClub": edit_club,
+        "deleteClub": delete_club,
+    }
+
+
+async def run_scenario(
+    client, build, requests: int, concurrency: int, warmup: int
+) -> dict:
+    """
+    Sends `requests` requests built by `build` from `concurrency` workers,
+    after `warmup` untimed ones.
+
+    Returns:
+        (dict): Throughput, latency percentiles in ms and error count.
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+
+    async def send(n: int) -> float:
+        nonlocal errors
+        query, variables, user = build(n)
+        headers = {"user": json.dumps(user), "cookies": "{}"}
+        start = time.perf_counter()
+        response = await client.post(
+            "/graphql",
+            json={"query": query, "variables": variables},
+            headers=headers,
+        )
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200 or response.json().get("errors"):
+            errors += 1
+        return elapsed
+
+    for n in range(warmup):
+        await send(next(counter))
+    errors = 0
+
+    async def worker(total: int):
+        for _ in range(total):
+            latencies.append(await send(next(counter)))
+
+    shares = [
+        requests // concurrency + (i < requests % concurrency)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(share) for share in shares))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def current_commit() -> str | None:
+    try:
+        process = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return process.stdout.strip() if process.returncode == 0 else None
+
+
+async def benchmark(args) -> dict:
+    gateway_port, files_port = free_port(), free_port()
+    os.environ["GATEWAY_URL"] = f"http://127.0.0.1:{gateway_port}/graphql"
+    os.environ["FILES_URL"] = f"http://127.0.0.1:{files_port}"
+    # the benchmark client would be throttled like any other client
+    for limit in ("QUERY_RATE", "QUERY_BURST", "MUTATION_RATE"):
+        os.environ.setdefault(limit, "1e9")
+    os.environ.setdefault("MUTATION_BURST", "1e9")
+
+    # imported only now, as the app reads its configuration on import
+    from bson import ObjectId
+    from httpx import ASGITransport, AsyncClient
+
+    import bulk
+    import db
+    import export
+    import mutations
+    import queries
+    import utils
+    from main import app
+    from models import create_utc_time
+
+    collection = MemoryCollection(latency=args.mongo_latency_ms / 1000)
+    collection.docs = [
+        {
+            "_id": ObjectId(),
+            "created_time": create_utc_time(),
+            **club_document(i),
+        }
+        for i in range(args.clubs)
+    ]
+    for module in (db, queries, mutations, utils, bulk, export):
+        module.clubsdb = collection
+        if hasattr(module, "public_clubsdb"):
+            module.public_clubsdb = collection
+
+    results = {}
+    async with (
+        serving(gateway_app, gateway_port),
+        serving(files_app, files_port),
+        AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://clubs"
+        ) as client,
+    ):
+        utils.file_cleanup_queue.start()
+        try:
+            for name, build in scenarios(args.clubs).items():
+                if args.only and name not in args.only:
+                    continue
+                results[name] = await run_scenario(
+                    client,
+                    build,
+                    args.requests,
+                    args.concurrency,
+                    args.warmup,
+                )
+                print(f"{name}: {results[name]}", flush=True)
+        finally:
+            await utils.file_cleanup_queue.stop()
+
+    return {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "clubs": args.clubs,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "mongo_latency_ms": args.mongo_latency_ms,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clubs", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--mongo-latency-ms",
+        type=float,
+        default=0.5,
+        help="Round trip time added to every MongoDB command",
+    )
+    parser.add_argument(
+        "--only", nargs="*", help="Names of the scenarios to be run"
+    )
+    parser.add_argument("--output", help="File the JSON results go to")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Local stand-ins for the services the clubs subgraph depends on.
+
+Provides an in-memory MongoDB collection implementing the subset of the
+`AsyncCollection` API used by the subgraph, and stub gateway and files
+microservices served over HTTP by uvicorn, so that benchmarks can run the
+app without any of the other services. The shared cache tier has its own
+in-process stand-in (`memory://`, see `shared_cache`).
+"""
+
+import asyncio
+import copy
+import socket
+from contextlib import asynccontextmanager
+
+import uvicorn
+from bson import ObjectId
+from graphql import FieldNode, OperationDefinitionNode, parse
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+
+def _get(doc: dict, path: str):
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _matches(doc: dict, query: dict | None) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, clause) for clause in condition):
+                return False
+            continue
+
+        value = _get(doc, key)
+        if isinstance(condition, dict) and any(
+            op.startswith("$") for op in condition
+        ):
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$exists" and (value is not None) != operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    # documents are copied, as decoding BSON would
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    if any(value for key, value in projection.items() if key != "_id"):
+        kept = {key for key, value in projection.items() if value}
+        doc = {
+            key: value
+            for key, value in doc.items()
+            if key in kept or key == "_id"
+        }
+    if projection.get("_id") == 0:
+        doc.pop("_id", None)
+    return doc
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    """Cursor over the results of `MemoryCollection.find`."""
+
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self._docs = None
+
+    def batch_size(self, size: int):
+        return self
+
+    def sort(self, key: str, direction: int = 1):
+        self._sort = (key, direction)
+        return self
+
+    async def _load(self):
+        if self._docs is None:
+            await self._collection._roundtrip()
+            docs = [
+                doc
+                for doc in self._collection.docs
+                if _matches(doc, self._query)
+            ]
+            if self._sort is not None:
+                key, direction = self._sort
+                docs.sort(
+                    key=lambda doc: _get(doc, key), reverse=direction < 0
+                )
+            self._docs = iter(_project(doc, self._projection) for doc in docs)
+
+    async def to_list(self, length=None) -> list:
+        await self._load()
+        return list(self._docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await self._load()
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    """
+    In-memory stand-in for a MongoDB collection.
+
+    Attributes:
+        docs (list): The documents of the collection.
+        latency (float): Seconds every command waits for, standing in for
+                         the round trip to the server.
+        unique (tuple): Fields with a unique index.
+        commands (int): Number of commands run.
+    """
+
+    def __init__(self, latency: float = 0, unique: tuple = ("cid",)):
+        self.docs = []
+        self.latency = latency
+        self.unique = unique
+        self.commands = 0
+
+    async def _roundtrip(self):
+        self.commands += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+    def _check_unique(self, doc: dict, ignore: dict | None = None):
+        for field in self.unique:
+            for other in self.docs:
+                if other is not ignore and other.get(field) == doc.get(field):
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error: {field}"
+                    )
+
+    def find(self, query=None, projection=None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, query, projection)
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        await self._roundtrip()
+        for doc in self.docs:
+            if _matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    async def insert_one(self, document: dict, **kwargs):
+        await self._roundtrip()
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        self.docs.append(copy.deepcopy(document))
+        return _Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._roundtrip()
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                self._check_unique(document)
+            except DuplicateKeyError as e:
+                errors.append(
+                    {"index": index, "code": 11000, "errmsg": str(e)}
+                )
+                if ordered:
+                    break
+                continue
+            self.docs.append(copy.deepcopy(document))
+            inserted.append(document["_id"])
+        if errors:
+            raise BulkWriteError(
+                {"writeErrors": errors, "nInserted": len(inserted)}
+            )
+        return _Result(inserted_ids=inserted)
+
+    def _replace(self, query: dict, replacement: dict) -> int:
+        for index, doc in enumerate(self.docs):
+            if _matches(doc, query):
+                replacement = copy.deepcopy(replacement)
+                replacement.setdefault("_id", doc["_id"])
+                self._check_unique(replacement, ignore=doc)
+                self.docs[index] = replacement
+                return 1
+        return 0
+
+    def _update(self, query: dict, update: dict) -> dict | None:
+        for doc in self.docs:
+            if _matches(doc, query):
+                for path, value in update.get("$set", {}).items():
+                    *parents, key = path.split(".")
+                    target = doc
+                    for parent in parents:
+                        target = target.setdefault(parent, {})
+                    target[key] = copy.deepcopy(value)
+                for path, value in update.get("$inc", {}).items():
+                    doc[path] = doc.get(path, 0) + value
+                return doc
+        return None
+
+    async def replace_one(self, query, replacement, **kwargs):
+        await self._roundtrip()
+        matched = self._replace(query, replacement)
+        return _Result(matched_count=matched, modified_count=matched)
+
+    async def update_one(self, query, update, **kwargs):
+        await self._roundtrip()
+        matched = int(self._update(query, update) is not None)
+        return _Result(matched_count=matched, modified_count=matched)
+
+    async def find_one_and_update(
+        self, query, update, projection=None, return_document=False, **kwargs
+    ):
+        await self._roundtrip()
+        before = next((doc for doc in self.docs if _matches(doc, query)), None)
+        if before is None:
+            return None
+        before = _project(before, projection)
+        doc = self._update(query, update)
+        return _project(doc, projection) if return_document else before
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        await self._roundtrip()
+        errors = []
+        matched = 0
+        for index, request in enumerate(requests):
+            try:
+                if any(key.startswith("$") for key in request._doc):
+                    matched += (
+                        self._update(request._filter, request._doc) is not None
+                    )
+                else:
+                    matched += self._replace(request._filter, request._doc)
+            except DuplicateKeyError as e:
+                errors.append(
+                    {"index": index, "code": 11000, "errmsg": str(e)}
+                )
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nMatched": matched})
+        return _Result(matched_count=matched, modified_count=matched)
+
+    async def index_information(self) -> dict:
+        await self._roundtrip()
+        return {"unique_clubs": {"key": [("cid", 1)], "unique": True}}
+
+    async def create_index(self, *args, **kwargs):
+        await self._roundtrip()
+
+
+async def _gateway(request):
+    """
+    Stub gateway, answering every root field of a GraphQL request: with a
+    profile for `userProfile`, and with true for the mutations.
+    """
+    payload = await request.json()
+    data = {}
+    for definition in parse(payload["query"]).definitions:
+        if not isinstance(definition, OperationDefinitionNode):
+            continue
+        for field in definition.selection_set.selections:
+            if not isinstance(field, FieldNode):
+                continue
+            key = field.alias.value if field.alias else field.name.value
+            if field.name.value == "userProfile":
+                data[key] = {
+                    "firstName": "Stub",
+                    "lastName": "User",
+                    "email": "stub@iiit.ac.in",
+                    "rollno": "2020000000",
+                }
+            else:
+                data[key] = True
+    return JSONResponse({"data": data})
+
+
+async def _delete_file(request):
+    return PlainTextResponse("deleted")
+
+
+gateway_app = Starlette(routes=[Route("/graphql", _gateway, methods=["POST"])])
+files_app = Starlette(
+    routes=[Route("/delete-file", _delete_file, methods=["POST"])]
+)
+
+
+def free_port() -> int:
+    """Returns a free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def serving(app, port: int):
+    """
+    Serves an ASGI app on localhost in the running event loop, until the
+    context is exited.
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app,
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+            lifespan="off",
+        )
+    )
+    task = asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield server
+    finally:
+        server.should_exit = True
+        await task
@@ -0,0 +1,242 @@
+"""
+Startup benchmark of a worker.
+
+Measures how long a new worker takes before it serves requests:
+
+- the import of `main` as reported by `python -X importtime`, along with
+  the modules taking the longest to import,
+- the time from starting a worker process to its first successful
+  GraphQL response and to its readiness, the worker being run by uvicorn
+  against an in-memory MongoDB stand-in (see `benchmarks.standins`).
+
+Each measurement is run in new processes several times, keeping the
+median. The results are written as JSON, along with the commit and
+configuration, and the benchmark fails if the import or the first request
+take longer than the given thresholds, so that startup regressions are
+caught before they slow down scale-ups.
+
+Usage (from the repository root):
+    python -m benchmarks.startup --runs 5 --max-import-ms 1500 \
+        --max-first-request-ms 3000 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.load import PUBLIC_USER, club_document, current_commit
+from benchmarks.standins import free_port
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def importtime() -> dict:
+    """
+    Imports `main` in a new process with `-X importtime`.
+
+    Returns:
+        (dict): The import time of `main` in ms, and the self and
+                cumulative times in ms of every module imported.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            modules[name] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return {"main_ms": modules["main"][1], "modules": modules}
+
+
+def serve(port: int, clubs: int):
+    """
+    Runs a worker on the given port against an in-memory MongoDB stand-in
+    seeded with clubs, the stand-in being put in place before the app is
+    imported.
+    """
+    from bson import ObjectId
+
+    import db
+    from benchmarks.standins import MemoryCollection
+    from models import create_utc_time
+
+    collection = MemoryCollection()
+    collection.docs = [
+        {"_id": ObjectId(), "created_time": create_utc_time(), **doc}
+        for doc in map(club_document, range(clubs))
+    ]
+
+    async def ping_mongo() -> bool:
+        return True
+
+    db.clubsdb = db.public_clubsdb = collection
+    db.ping_mongo = ping_mongo
+
+    import uvicorn
+
+    from main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def time_to_serve(clubs: int, timeout: float) -> dict:
+    """
+    Starts a worker in a new process and polls it until it answers a
+    GraphQL query and reports being ready.
+
+    Returns:
+        (dict): The time in ms from starting the process to the first
+                successful GraphQL response, and to readiness.
+    """
+    # imported here, keeping it out of the workers
+    import httpx
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.startup",
+            "--serve",
+            str(port),
+            "--clubs",
+            str(clubs),
+        ],
+        env={**os.environ, "PYTHONUNBUFFERED": "1"},
+        stdout=subprocess.DEVNULL,
+    )
+
+    first_request = ready = None
+    try:
+        with httpx.Client(base_url=base_url, timeout=1) as client:
+            while ready is None or first_request is None:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError("The worker didn't start in time")
+                if worker.poll() is not None:
+                    raise RuntimeError("The worker exited")
+                try:
+                    if first_request is None:
+                        response = client.post(
+                            "/graphql",
+                            json={"query": "{ allClubs { cid } }"},
+                            headers={
+                                "user": json.dumps(PUBLIC_USER),
+                                "cookies": "{}",
+                            },
+                        )
+                        if response.status_code == 200 and not (
+                            response.json().get("errors")
+                        ):
+                            first_request = time.perf_counter() - start
+                    if ready is None:
+                        if client.get("/readyz").status_code == 200:
+                            ready = time.perf_counter() - start
+                except httpx.TransportError:
+                    time.sleep(0.005)
+    finally:
+        worker.terminate()
+        worker.wait()
+
+    return {
+        "first_request_ms": round(first_request * 1000, 1),
+        "ready_ms": round(ready * 1000, 1),
+    }
+
+
+def benchmark(args) -> dict:
+    imports = [importtime() for _ in range(args.runs)]
+    main_ms = statistics.median(run["main_ms"] for run in imports)
+    modules = imports[-1]["modules"]
+    slowest = sorted(modules.items(), key=lambda item: -item[1][0])
+
+    starts = [
+        time_to_serve(args.clubs, args.timeout) for _ in range(args.runs)
+    ]
+
+    return {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "config": {"runs": args.runs, "clubs": args.clubs},
+        "results": {
+            "import_main_ms": round(main_ms, 1),
+            "modules_imported": len(modules),
+            "slowest_imports": [
+                {"module": name, "self_ms": self_ms, "cumulative_ms": total}
+                for name, (self_ms, total) in slowest[: args.top]
+            ],
+            "first_request_ms": statistics.median(
+                start["first_request_ms"] for start in starts
+            ),
+            "ready_ms": statistics.median(
+                start["ready_ms"] for start in starts
+            ),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--clubs", type=int, default=500)
+    parser.add_argument(
+        "--top", type=int, default=15, help="Slowest imports reported"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Seconds a worker is given to start",
+    )
+    parser.add_argument(
+        "--max-import-ms",
+        type=float,
+        default=float(os.getenv("STARTUP_MAX_IMPORT_MS", "1500")),
+        help="Fail if importing main takes longer",
+    )
+    parser.add_argument(
+        "--max-first-request-ms",
+        type=float,
+        default=float(os.getenv("STARTUP_MAX_FIRST_REQUEST_MS", "3000")),
+        help="Fail if the first request is answered later",
+    )
+    parser.add_argument("--output", help="File the JSON results go to")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.clubs)
+        return
+
+    results = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    regressions = []
+    if results["results"]["import_main_ms"] > args.max_import_ms:
+        regressions.append(f"importing main took over {args.max_import_ms}ms")
+    if results["results"]["first_request_ms"] > args.max_first_request_ms:
+        regressions.append(
+            f"the first request took over {args.max_first_request_ms}ms"
+        )
+    if regressions:
+        sys.exit("Startup regression: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Circuit Breakers for Downstream Services
+
+This module provides circuit breakers for the services the clubs subgraph
+depends on (the gateway and the files microservice). A breaker opens after
+a number of consecutive failures, making further calls fail fast instead of
+waiting on a slow or down service. After a cool down it lets a single probe
+call through (half open), closing again if the probe succeeds. Only the
+probe decides the state of a circuit that isn't closed, calls let through
+before it opened finishing meanwhile are only counted. Calls cut short by
+the deadline of the request (see `deadline`) say nothing of the service,
+and are neither failures nor successes.
+
+Every breaker also carries the timeout to be used for calls to its service.
+All of these are configurable per service through environment variables,
+e.g. for the gateway `GATEWAY_TIMEOUT` (seconds, default 5),
+`GATEWAY_BREAKER_THRESHOLD` (failures, default 5) and
+`GATEWAY_BREAKER_RESET_TIMEOUT` (seconds, default 30).
+
+Attributes:
+    breakers (dict): Registry of all circuit breakers, keyed on name.
+"""
+
+import asyncio
+import time
+from os import getenv
+
+from deadline import DeadlineExceeded
+
+breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker guarding calls to one downstream service.
+
+    Used as an async context manager around a call, which raises
+    `CircuitOpenError` on entering if the circuit is open, and records the
+    call as a failure if it raises.
+
+    Attributes:
+        name (str): Name of the service.
+        timeout (float): Timeout for calls to the service, in seconds.
+        threshold (int): Consecutive failures after which the circuit opens.
+        reset_timeout (float): Seconds after which an open circuit lets a
+                               probe call through.
+        state (str): One of "closed", "open" and "half_open".
+        calls (int): Number of calls let through.
+        failures (int): Number of calls that failed.
+        rejections (int): Number of calls failed fast.
+        opened (int): Number of times the circuit opened.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 5,
+        threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.calls = 0
+        self.failures = 0
+        self.rejections = 0
+        self.opened = 0
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe = None
+        breakers[name] = self
+
+    @classmethod
+    def from_env(cls, name: str) -> "CircuitBreaker":
+        """Creates a breaker configured from the service's env variables."""
+        prefix = name.upper()
+        return cls(
+            name,
+            timeout=float(getenv(f"{prefix}_TIMEOUT", "5")),
+            threshold=int(getenv(f"{prefix}_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(
+                getenv(f"{prefix}_BREAKER_RESET_TIMEOUT", "30")
+            ),
+        )
+
+    async def __aenter__(self):
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.rejections += 1
+                raise CircuitOpenError(f"The {self.name} service is down")
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            # only one probe at a time, fail fast the others
+            if self._probe is not None:
+                self.rejections += 1
+                raise CircuitOpenError(f"The {self.name} service is down")
+            self._probe = asyncio.current_task()
+
+        self.calls += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # a task makes one call at a time, so the probe is the call of the
+        # task it was let through for
+        probe = (
+            self._probe is not None and self._probe is asyncio.current_task()
+        )
+        if probe:
+            self._probe = None
+        if exc_type is not None and issubclass(
+            exc_type, (asyncio.CancelledError, DeadlineExceeded)
+        ):
+            return False
+
+        if self.state != "closed" and not probe:
+            if exc_type is not None:
+                self.failures += 1
+            return False
+
+        if exc_type is None:
+            self.state = "closed"
+            self._consecutive_failures = 0
+            return False
+
+        self.failures += 1
+        self._consecutive_failures += 1
+        if probe or self._consecutive_failures >= self.threshold:
+            if self.state != "open":
+                self.opened += 1
+                print(f"Circuit for the {self.name} service opened: {exc}")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+        return False
+
+    def stats(self) -> dict:
+        """
+        Returns the current state and counters of the breaker.
+        """
+        return {
+            "name": self.name,
+            "state": self.state,
+            "timeout": self.timeout,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejections": self.rejections,
+            "opened": self.opened,
+        }
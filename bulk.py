@@ -0,0 +1,354 @@
+"""
+Bulk Operations on Clubs
+
+Helpers for creating and editing many clubs at once, used by the
+`bulkCreateClubs`, `bulkEditClubs` and `importClubs` mutations. All rows
+are validated up front, users are looked up and roles updated in batched
+gateway requests, new clubs are written with a single `insert_many` and
+edited ones with concurrent conditional replacements, and the caches are
+invalidated once at the end. Every row gets its own result, so one bad
+row doesn't fail the others.
+
+Attributes:
+    BULK_MAX_ROWS (int): Max number of rows accepted by a bulk operation.
+                         Defaults to 500.
+    IMPORT_FIELDS (set): Fields a club can have in imported data.
+"""
+
+import asyncio
+import csv
+import io
+import json
+from os import getenv
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from db import clubsdb
+from models import Club, create_utc_time
+from otypes import BulkClubResultType, EnumImportFormats
+from sessions import current_session
+from utils import (
+    check_remove_old_file,
+    getUsers,
+    invalidate_club_cache,
+    invalidate_club_lists,
+    invalidate_missing_club_cache,
+    update_events_members_cid,
+    update_roles,
+    version_conflict,
+    version_query,
+)
+
+BULK_MAX_ROWS = int(getenv("BULK_MAX_ROWS", "500"))
+IMPORT_FIELDS = {
+    "cid",
+    "code",
+    "name",
+    "email",
+    "category",
+    "tagline",
+    "description",
+    "socials",
+    "logo",
+    "banner",
+    "banner_square",
+}
+
+
+def parse_import(data: str, data_format: EnumImportFormats) -> list[dict]:
+    """
+    Parses the data of clubs to be imported into one dict per club.
+
+    JSON data must be a list of objects with the fields of `FullClubInput`.
+    CSV data must have a header row with the same fields, social handles
+    being given as `socials.<field>` columns and `socials.other_links`
+    being whitespace separated. Empty CSV cells are left out.
+
+    Args:
+        data (str): The data to be imported.
+        data_format (otypes.EnumImportFormats): Format of the data.
+
+    Returns:
+        (list[dict]): The rows of the data.
+
+    Raises:
+        ValueError: If the data is not a list of clubs.
+    """
+    if data_format == EnumImportFormats.json:
+        rows = json.loads(data)
+        if not isinstance(rows, list) or not all(
+            isinstance(row, dict) for row in rows
+        ):
+            raise ValueError("JSON data must be a list of clubs")
+        return rows
+
+    rows = []
+    for record in csv.DictReader(io.StringIO(data), restkey="extra"):
+        row = {}
+        socials = {}
+        for key, value in record.items():
+            if isinstance(value, str):
+                value = value.strip() or None
+            if key.startswith("socials."):
+                field = key.removeprefix("socials.")
+                if field == "other_links":
+                    socials[field] = value.split() if value else []
+                else:
+                    socials[field] = value
+            elif value is not None:
+                row[key] = value
+        if socials:
+            row["socials"] = socials
+        rows.append(row)
+    return rows
+
+
+def _to_club_input(row) -> dict:
+    """Validates a row, either an imported dict or a FullClubInput."""
+    if not isinstance(row, dict):
+        return jsonable_encoder(row.to_pydantic())
+
+    unknown = set(row) - IMPORT_FIELDS
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    # like in createClub, the cid of a club is its email's username
+    if "cid" not in row and isinstance(row.get("email"), str):
+        row = {**row, "cid": row["email"].split("@")[0]}
+    return jsonable_encoder(Club.model_validate(row))
+
+
+def _describe_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, e['loc']))}: {e['msg']}"
+            for e in error.errors()
+        )
+    return str(error)
+
+
+class _BulkRows:
+    """
+    Tracks the rows of a bulk operation that are still pending, and the
+    results of the ones that are done.
+    """
+
+    def __init__(self, rows: list):
+        if len(rows) > BULK_MAX_ROWS:
+            raise Exception(f"At most {BULK_MAX_ROWS} clubs can be sent")
+
+        self.pending = {}
+        self.results = {}
+        for row, data in enumerate(rows):
+            try:
+                self.pending[row] = _to_club_input(data)
+            except Exception as e:
+                self.results[row] = BulkClubResultType(
+                    row=row, cid=None, success=False, error=_describe_error(e)
+                )
+
+    def fail(self, row: int, error: str):
+        club_input = self.pending.pop(row)
+        self.results[row] = BulkClubResultType(
+            row=row, cid=club_input["cid"], success=False, error=error
+        )
+
+    def fail_duplicates(self, field: str, error: str):
+        seen = set()
+        for row, club_input in list(self.pending.items()):
+            if club_input[field] in seen:
+                self.fail(row, error)
+            seen.add(club_input[field])
+
+    def fail_write_errors(self, rows: list[int], error: BulkWriteError):
+        for write_error in error.details.get("writeErrors", []):
+            self.fail(rows[write_error["index"]], write_error["errmsg"])
+
+    def succeed_pending(self):
+        for row, club_input in self.pending.items():
+            self.results[row] = BulkClubResultType(
+                row=row, cid=club_input["cid"], success=True
+            )
+        self.pending = {}
+
+    def ordered_results(self) -> list[BulkClubResultType]:
+        return [self.results[row] for row in sorted(self.results)]
+
+
+async def bulk_create_clubs(rows: list, cookies=None) -> list:
+    """
+    Creates many clubs at once, the bulk version of `createClub`.
+
+    Args:
+        rows (list): FullClubInputs or imported dicts of the clubs.
+        cookies (dict): Cookies from the request. Defaults to None.
+
+    Returns:
+        (list[otypes.BulkClubResultType]): Result of every row, in order.
+    """
+    bulk = _BulkRows(rows)
+    for club_input in bulk.pending.values():
+        club_input["cid"] = club_input["email"].split("@")[0]
+
+    bulk.fail_duplicates("cid", "A club with this cid already exists")
+    bulk.fail_duplicates("code", "A club with this short code already exists")
+
+    cids = [club_input["cid"] for club_input in bulk.pending.values()]
+    codes = [club_input["code"] for club_input in bulk.pending.values()]
+    existing, users = await asyncio.gather(
+        clubsdb.find(
+            {"$or": [{"cid": {"$in": cids}}, {"code": {"$in": codes}}]},
+            {"cid": 1, "code": 1},
+            session=current_session(),
+        ).to_list(length=None),
+        getUsers(cids, cookies),
+    )
+    existing_cids = {club["cid"] for club in existing}
+    existing_codes = {club["code"] for club in existing}
+
+    for row, club_input in list(bulk.pending.items()):
+        if club_input["cid"] in existing_cids:
+            bulk.fail(row, "A club with this cid already exists")
+        elif users.get(club_input["cid"]) is None:
+            bulk.fail(row, "Invalid Club ID/Club Email")
+        elif club_input["code"] in existing_codes:
+            bulk.fail(row, "A club with this short code already exists")
+
+    if bulk.pending:
+        rows_written = list(bulk.pending)
+        try:
+            await clubsdb.insert_many(
+                list(bulk.pending.values()),
+                ordered=False,
+                session=current_session(),
+            )
+        except BulkWriteError as e:
+            bulk.fail_write_errors(rows_written, e)
+
+    created = {row: ci["cid"] for row, ci in bulk.pending.items()}
+    roles_updated = await update_roles(list(created.values()), cookies)
+    for row, cid in created.items():
+        if not roles_updated.get(cid):
+            bulk.fail(row, "Error in updating the role for the club")
+
+    # the lists are read again rather than patched with every club
+    await invalidate_club_lists()
+    for cid in created.values():
+        await invalidate_missing_club_cache(cid)
+
+    bulk.succeed_pending()
+    return bulk.ordered_results()
+
+
+async def bulk_edit_clubs(rows: list, cookies=None) -> list:
+    """
+    Edits many clubs at once, the bulk version of `editClub` for CC.
+
+    Clubs are matched on their code, like in `editClub`.
+
+    Args:
+        rows (list): FullClubInputs or imported dicts of the clubs.
+        cookies (dict): Cookies from the request. Defaults to None.
+
+    Returns:
+        (list[otypes.BulkClubResultType]): Result of every row, in order.
+    """
+    bulk = _BulkRows(rows)
+    bulk.fail_duplicates("code", "A club with this code is repeated")
+    bulk.fail_duplicates("cid", "A club with this cid is repeated")
+
+    codes = [club_input["code"] for club_input in bulk.pending.values()]
+    cids = [club_input["cid"] for club_input in bulk.pending.values()]
+    existing, users = await asyncio.gather(
+        clubsdb.find(
+            {"code": {"$in": codes}}, session=current_session()
+        ).to_list(length=None),
+        getUsers(cids, cookies),
+    )
+    existing = {club["code"]: club for club in existing}
+
+    old_clubs = {}
+    for row, club_input in list(bulk.pending.items()):
+        exists = existing.get(club_input["code"])
+        if not exists:
+            bulk.fail(row, "A club with this code doesn't exist")
+        elif users.get(club_input["cid"]) is None:
+            bulk.fail(row, "Invalid Club ID/Club Email")
+        else:
+            old_clubs[row] = exists
+            club_input["state"] = exists["state"]
+            club_input["_id"] = exists["_id"]
+            club_input["created_time"] = exists["created_time"]
+            club_input["updated_time"] = create_utc_time()
+            club_input["version"] = exists.get("version", 0) + 1
+
+    # every row is replaced only if its club wasn't changed since it was
+    # read, like in `editClub`, the replacements being sent concurrently
+    session = current_session()
+    results = await asyncio.gather(
+        *(
+            clubsdb.replace_one(
+                {
+                    "_id": club_input["_id"],
+                    "version": version_query(club_input["version"] - 1),
+                },
+                club_input,
+                session=session,
+            )
+            for club_input in bulk.pending.values()
+        ),
+        return_exceptions=True,
+    )
+    for (row, club_input), result in zip(list(bulk.pending.items()), results):
+        if isinstance(result, Exception):
+            bulk.fail(row, _describe_error(result))
+        elif result.matched_count == 0:
+            bulk.fail(row, version_conflict(club_input["cid"]).message)
+
+    await asyncio.gather(
+        *(
+            check_remove_old_file(old_clubs[row], club_input, name)
+            for row, club_input in bulk.pending.items()
+            for name in ("logo", "banner", "banner_square")
+        )
+    )
+
+    renames = {
+        row: (old_clubs[row]["cid"], club_input["cid"])
+        for row, club_input in bulk.pending.items()
+        if old_clubs[row]["cid"] != club_input["cid"]
+    }
+    if renames:
+        old_roles, new_roles, *cids_updated = await asyncio.gather(
+            update_roles(
+                [old for old, _ in renames.values()], cookies, role="public"
+            ),
+            update_roles(
+                [new for _, new in renames.values()], cookies, role="club"
+            ),
+            *(
+                update_events_members_cid(old, new, cookies=cookies)
+                for old, new in renames.values()
+            ),
+        )
+        for (row, (old, new)), cid_updated in zip(
+            renames.items(), cids_updated
+        ):
+            if (
+                not old_roles.get(old)
+                or not new_roles.get(new)
+                or not cid_updated
+            ):
+                bulk.fail(row, "Error in updating the role/cid.")
+
+    await invalidate_club_lists()
+    for exists in old_clubs.values():
+        await invalidate_club_cache(exists["cid"])
+    for old, new in renames.values():
+        await invalidate_club_cache(new)
+        await invalidate_missing_club_cache(new)
+
+    bulk.succeed_pending()
+    return bulk.ordered_results()
@@ -0,0 +1,167 @@
+"""
+Instrumented Cache Module.
+
+This module provides a byte-budgeted cache with per-entry expiry and
+hit/miss/eviction counters, used for all in-process caches of the clubs
+subgraph.
+
+Attributes:
+    caches (dict): Registry of all instrumented caches, keyed on cache name.
+"""
+
+import sys
+import time
+from enum import Enum
+
+from cachetools import TLRUCache
+
+caches = {}
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """
+    Approximates the memory used by an object and everything it references.
+
+    Shared singletons such as enum members, booleans and None are not
+    counted, and every object is counted only once.
+
+    Args:
+        obj (Any): The object to be measured.
+        seen (set | None): Ids of already counted objects. Defaults to None.
+
+    Returns:
+        (int): Approximate size of the object in bytes.
+    """
+    if obj is None or isinstance(obj, (bool, Enum, type)):
+        return 0
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float)):
+        return size
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen) + deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_sizeof(item, seen)
+
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        size += deep_sizeof(getattr(obj, slot, None), seen)
+
+    return size
+
+
+class InstrumentedCache(TLRUCache):
+    """
+    A time aware LRU cache bounded by the approximate size of its values.
+
+    Every entry expires after the cache's default `ttl`, unless a different
+    ttl is given while setting it. Hits, misses, evictions (due to the byte
+    budget) and expirations are counted, and the cache registers itself in
+    `caches` under its name.
+
+    Attributes:
+        name (str): Name of the cache.
+        ttl (float): Default time to live of an entry, in seconds.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found in the cache.
+        evictions (int): Number of entries evicted to stay within budget.
+        expirations (int): Number of entries removed after their ttl.
+        rejections (int): Number of values too large to be cached at all.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        ttl: float,
+        getsizeof=deep_sizeof,
+        timer=time.monotonic,
+    ):
+        super().__init__(
+            maxsize=max_bytes,
+            ttu=self._time_to_use,
+            timer=timer,
+            getsizeof=getsizeof,
+        )
+        self.name = name
+        self.ttl = ttl
+        self._entry_ttl = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejections = 0
+        caches[name] = self
+
+    def _time_to_use(self, key, value, now):
+        ttl = self.ttl if self._entry_ttl is None else self._entry_ttl
+        return now + ttl
+
+    def get(self, key, default=None):
+        if key in self:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float | None = None) -> bool:
+        """
+        Caches a value, optionally with its own time to live.
+
+        Args:
+            key (Hashable): Key of the entry.
+            value (Any): Value of the entry.
+            ttl (float | None): Time to live of this entry in seconds.
+                                Defaults to the cache's ttl.
+
+        Returns:
+            (bool): False if the value is larger than the whole budget.
+        """
+        self._entry_ttl = ttl
+        try:
+            self[key] = value
+        except ValueError:
+            self.rejections += 1
+            return False
+        finally:
+            self._entry_ttl = None
+        return True
+
+    def popitem(self):
+        self.evictions += 1
+        return super().popitem()
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+    def stats(self) -> dict:
+        """
+        Returns the current size and counters of the cache.
+        """
+        self.expire()
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self),
+            "size_bytes": self.currsize,
+            "max_bytes": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "rejections": self.rejections,
+        }
@@ -0,0 +1,142 @@
+"""
+Query Cost Analysis
+
+This module provides a Strawberry extension rejecting operations that would
+cost too much to resolve, before they are executed. Every root field has a
+cost (see `queries.query_costs`), fields that scan the collection costing
+more than lookups served from the caches, and the cost of an operation is
+the sum over all the root fields it selects. As every alias of a field is
+resolved separately, every alias is counted, so that an operation asking
+for `allClubs` under 200 aliases costs 200 times as much.
+
+In debug mode, the computed cost and the budget are reported in the
+`cost` entry of the response's extensions.
+
+Attributes:
+    QUERY_COST_BUDGET (int): Max cost of an operation. Defaults to 100.
+    DEFAULT_FIELD_COST (int): Cost of root fields without a cost of their
+                              own. Defaults to 1.
+    MAX_QUERY_DEPTH (int): Max depth of the fields of an operation.
+                           Defaults to 10.
+"""
+
+from os import getenv
+
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+)
+from strawberry.extensions import SchemaExtension
+
+QUERY_COST_BUDGET = int(getenv("QUERY_COST_BUDGET", "100"))
+DEFAULT_FIELD_COST = int(getenv("DEFAULT_FIELD_COST", "1"))
+MAX_QUERY_DEPTH = int(getenv("MAX_QUERY_DEPTH", "10"))
+
+DEBUG = getenv("GLOBAL_DEBUG", "False").lower() in ("true", "1", "t")
+
+
+def _root_fields(selection_set, fragments: dict, visited: set):
+    """
+    Yields the field nodes of a selection set, expanding fragments.
+    """
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _root_fields(
+                selection.selection_set, fragments, visited
+            )
+        elif isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            if name in visited or name not in fragments:
+                continue
+            visited.add(name)
+            yield from _root_fields(
+                fragments[name].selection_set, fragments, visited
+            )
+
+
+def operation_cost(document, operation_name: str | None, costs: dict) -> int:
+    """
+    Computes the cost of an operation of a GraphQL document.
+
+    Args:
+        document (DocumentNode): The parsed GraphQL document.
+        operation_name (str | None): Name of the operation to be executed,
+                                     None if the document has only one.
+        costs (dict): Costs of the root fields, keyed on field name.
+
+    Returns:
+        (int): The sum of the costs of every root field selected.
+    """
+    operation = None
+    fragments = {}
+    for definition in document.definitions:
+        if isinstance(definition, OperationDefinitionNode):
+            if operation_name is None or (
+                definition.name and definition.name.value == operation_name
+            ):
+                operation = operation or definition
+        else:
+            fragments[definition.name.value] = definition
+
+    if operation is None:
+        return 0
+
+    cost = 0
+    for field in _root_fields(operation.selection_set, fragments, set()):
+        name = field.name.value
+        if name.startswith("__"):
+            # introspection and __typename
+            continue
+        cost += costs.get(name, DEFAULT_FIELD_COST)
+    return cost
+
+
+class CostAnalysisExtension(SchemaExtension):
+    """
+    Strawberry extension rejecting operations over the cost budget.
+
+    Subclasses set `costs` to the costs of the schema's root fields.
+    """
+
+    costs = {}
+    budget = QUERY_COST_BUDGET
+
+    @classmethod
+    def with_costs(cls, costs: dict, budget: int = QUERY_COST_BUDGET):
+        """Creates an extension class using the given field costs."""
+        return type(cls.__name__, (cls,), {"costs": costs, "budget": budget})
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        self.cost = operation_cost(
+            execution_context.graphql_document,
+            execution_context.operation_name,
+            self.costs,
+        )
+        if self.cost > self.budget:
+            execution_context.result = ExecutionResult(
+                data=None,
+                errors=[
+                    GraphQLError(
+                        f"Query cost {self.cost} exceeds the budget of "
+                        f"{self.budget}",
+                        extensions={
+                            "code": "QUERY_TOO_EXPENSIVE",
+                            "cost": self.cost,
+                            "budget": self.budget,
+                        },
+                    )
+                ],
+            )
+        yield
+
+    def get_results(self) -> dict:
+        if not DEBUG or not hasattr(self, "cost"):
+            return {}
+        return {"cost": {"requested": self.cost, "budget": self.budget}}
@@ -12,15 +12,47 @@ Attributes:
     MONGO_PORT (str): MongoDB port. Defaults to "27017".
     MONGO_URI (str): MongoDB URI.
     MONGO_DATABASE (str): MongoDB database name.
+    MONGO_MAX_POOL_SIZE (int): Max connections per server. Defaults to 100.
+    MONGO_MIN_POOL_SIZE (int): Connections kept open per server.
+                               Defaults to 0.
+    MONGO_COMPRESSORS (str): Comma separated wire compressors to offer the
+                             server, out of "zstd", "snappy" and "zlib".
+                             Defaults to none.
+    MONGO_CONNECT_TIMEOUT_MS (int): Timeout for opening a connection.
+                                    Defaults to 20000.
+    MONGO_SERVER_SELECTION_TIMEOUT_MS (int): Timeout for finding a server
+                                             for an operation.
+                                             Defaults to 30000.
+    MONGO_SOCKET_TIMEOUT_MS (int | None): Timeout for a reply on an open
+                                          connection. Defaults to None.
+    MONGO_PUBLIC_READ_PREFERENCE (str): Read preference of public queries.
+                                        Defaults to "secondaryPreferred".
+    MONGO_MAX_STALENESS_SECONDS (int): Max replication lag of a secondary
+                                       serving public queries, at least
+                                       90, or -1 for no bound.
+                                       Defaults to 90.
     client (pymongo.AsyncMongoClient): MongoDB async client.
     db (pymongo.asynchronous.database.AsyncDatabase): MongoDB database.
     clubsdb (pymongo.asynchronous.collection.AsyncCollection): MongoDB
                                                              clubs collection.
+    public_clubsdb (pymongo.asynchronous.collection.AsyncCollection): The
+        clubs collection, reading with the public read preference.
 """
 
 from os import getenv
 
 from pymongo import AsyncMongoClient
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+
+from metrics import MongoCommandMetrics
+from profiling import MongoCommandCounter
+from tracing import TracingCommandListener
 
 # get mongodb URI and database name from environment variale
 MONGO_URI = "mongodb://{}:{}@mongo:{}/".format(
@@ -30,15 +62,95 @@ MONGO_URI = "mongodb://{}:{}@mongo:{}/".format(
 )
 MONGO_DATABASE = getenv("MONGO_DATABASE", default="default")
 
-# instantiate mongo client
-client = AsyncMongoClient(MONGO_URI)
+# connection settings
+MONGO_MAX_POOL_SIZE = int(getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_COMPRESSORS = getenv("MONGO_COMPRESSORS", "")
+MONGO_CONNECT_TIMEOUT_MS = int(getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+)
+MONGO_SOCKET_TIMEOUT_MS = getenv("MONGO_SOCKET_TIMEOUT_MS")
+
+# read routing of public queries
+MONGO_PUBLIC_READ_PREFERENCE = getenv(
+    "MONGO_PUBLIC_READ_PREFERENCE", "secondaryPreferred"
+)
+MONGO_MAX_STALENESS_SECONDS = int(getenv("MONGO_MAX_STALENESS_SECONDS", "90"))
+
+client_options = {
+    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+    "minPoolSize": MONGO_MIN_POOL_SIZE,
+    "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+}
+if MONGO_COMPRESSORS:
+    client_options["compressors"] = MONGO_COMPRESSORS
+if MONGO_SOCKET_TIMEOUT_MS:
+    client_options["socketTimeoutMS"] = int(MONGO_SOCKET_TIMEOUT_MS)
+
+# instantiate mongo client, recording the latency of every command
+client = AsyncMongoClient(
+    MONGO_URI,
+    event_listeners=[
+        MongoCommandMetrics(),
+        MongoCommandCounter(),
+        TracingCommandListener(),
+    ],
+    **client_options,
+)
 
 # get database
 db = client[MONGO_DATABASE]
 clubsdb = db.clubs
 
 
-async def ensure_clubs_index():
+def public_read_preference():
+    """
+    Returns the read preference of public queries, as configured.
+
+    Raises:
+        ValueError: If the read preference is unknown.
+    """
+    modes = {
+        "primarypreferred": PrimaryPreferred,
+        "secondary": Secondary,
+        "secondarypreferred": SecondaryPreferred,
+        "nearest": Nearest,
+    }
+    mode = MONGO_PUBLIC_READ_PREFERENCE.lower()
+    if mode == "primary":
+        return Primary()
+    if mode not in modes:
+        raise ValueError(f"Unknown read preference {mode}")
+    return modes[mode](max_staleness=MONGO_MAX_STALENESS_SECONDS)
+
+
+# public queries may be served by secondaries
+public_clubsdb = clubsdb.with_options(read_preference=public_read_preference())
+
+
+async def ping_mongo() -> bool:
+    """
+    Checks whether the MongoDB server is reachable.
+
+    Returns:
+        (bool): True if the server answered a ping, False otherwise.
+    """
+    try:
+        await client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+async def ensure_clubs_index() -> bool:
+    """
+    Creates the unique cid index on the clubs collection if it is missing.
+
+    Returns:
+        (bool): True if the index exists, False if it could not be checked.
+    """
     try:
         indexes = await clubsdb.index_information()
         if "unique_clubs" in indexes:
@@ -49,5 +161,6 @@ async def ensure_clubs_index():
             )
             print("The clubs index was created.")
         print(await clubsdb.index_information())
+        return True
     except Exception:
-        pass
+        return False
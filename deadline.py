@@ -0,0 +1,117 @@
+"""
+Per-request Deadlines
+
+This module gives every GraphQL request a time budget, so that no database
+query or outbound call keeps working for a request the client has given up
+on. The budget is read from the `X-Request-Timeout-Ms` header (as sent by
+the gateway), or defaults to `REQUEST_TIMEOUT` seconds, and is turned into
+a deadline kept in the request's `otypes.Context`.
+
+While a request executes, its deadline is applied to every MongoDB
+operation through `pymongo.timeout`, and the remaining time is available
+to outbound HTTP calls through `remaining_time`.
+
+Attributes:
+    REQUEST_TIMEOUT (float): Default budget of a request in seconds.
+                             Defaults to 10.
+    MAX_REQUEST_TIMEOUT (float): Max budget a request can ask for in
+                                 seconds. Defaults to 60.
+    DEADLINE_HEADER (str): Header with the budget of a request in ms.
+"""
+
+import math
+import time
+from contextvars import ContextVar
+from os import getenv
+
+import pymongo
+from graphql import ExecutionResult, GraphQLError
+from strawberry.extensions import SchemaExtension
+
+REQUEST_TIMEOUT = float(getenv("REQUEST_TIMEOUT", "10"))
+MAX_REQUEST_TIMEOUT = float(getenv("MAX_REQUEST_TIMEOUT", "60"))
+DEADLINE_HEADER = "x-request-timeout-ms"
+
+_current_deadline = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has run out of its time budget."""
+
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+
+def deadline_from_headers(headers, started_at: float) -> float:
+    """
+    Computes the deadline of a request on the `time.monotonic` clock.
+
+    Args:
+        headers (Mapping): Headers of the request.
+        started_at (float): Time at which the request was received.
+
+    Returns:
+        (float): The deadline of the request.
+    """
+    budget = REQUEST_TIMEOUT
+    if headers is not None and DEADLINE_HEADER in headers:
+        try:
+            requested = float(headers[DEADLINE_HEADER]) / 1000
+        except ValueError:
+            requested = math.nan
+        # nan and inf would disable the deadline, so they get the default
+        if math.isfinite(requested):
+            budget = requested
+    return started_at + min(budget, MAX_REQUEST_TIMEOUT)
+
+
+def remaining_time() -> float | None:
+    """
+    Returns the seconds left before the current request's deadline, or
+    None outside of a request.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+
+def bounded_timeout(timeout: float) -> float:
+    """
+    Caps a timeout by the time left for the current request.
+
+    Raises:
+        DeadlineExceeded: If the deadline has already passed.
+    """
+    remaining = remaining_time()
+    return timeout if remaining is None else min(timeout, remaining)
+
+
+class DeadlineExtension(SchemaExtension):
+    """
+    Strawberry extension applying the request's deadline while executing.
+    """
+
+    def on_execute(self):
+        deadline = self.execution_context.context.deadline
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.execution_context.result = ExecutionResult(
+                data=None, errors=[GraphQLError(str(DeadlineExceeded()))]
+            )
+            yield
+            return
+
+        token = _current_deadline.set(deadline)
+        try:
+            with pymongo.timeout(remaining):
+                yield
+        finally:
+            _current_deadline.reset(token)
@@ -1,4 +1,13 @@
 #!/bin/bash
 
 cp ./schema.graphql /subgraphs/clubs.graphql
-uvicorn main:app --host 0.0.0.0 --port 80 --log-config config/uvicorn_config.json
+
+# WEB_CONCURRENCY worker processes (1 by default), sharing their caches
+# through SHARED_CACHE_URL when given. On SIGHUP the workers are restarted
+# one after the other, each finishing its requests (for up to
+# GRACEFUL_TIMEOUT seconds) before exiting; SIGTTIN and SIGTTOU add and
+# remove a worker.
+exec uvicorn main:app --host 0.0.0.0 --port 80 \
+    --workers "${WEB_CONCURRENCY:-1}" \
+    --timeout-graceful-shutdown "${GRACEFUL_TIMEOUT:-30}" \
+    --log-config config/uvicorn_config.json
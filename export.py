@@ -0,0 +1,135 @@
+"""
+Export Routes for Clubs
+
+This module provides a FastAPI router for exporting the clubs collection
+as newline-delimited JSON (NDJSON), for backups and data warehouse syncs.
+Documents are streamed from the database cursor in batches, so the memory
+used does not grow with the size of the collection. Other services
+authenticate with the inter communication secret, sent in the
+`X-Inter-Communication-Secret` header (never in the URL, which ends up in
+access logs).
+
+Attributes:
+    EXPORT_BATCH_SIZE (int): Number of documents fetched and written at a
+                             time. Defaults to 500.
+    SECRET_HEADER (str): Header the inter communication secret is sent in.
+    router (APIRouter): Router with the export routes.
+"""
+
+import hmac
+import json
+import zlib
+from os import getenv
+from typing import AsyncIterator
+
+from bson import json_util
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from db import clubsdb
+from models import EnumStates
+from utils import inter_communication_secret
+
+EXPORT_BATCH_SIZE = int(getenv("EXPORT_BATCH_SIZE", "500"))
+SECRET_HEADER = "X-Inter-Communication-Secret"
+
+router = APIRouter()
+
+
+def _is_authorized(request: Request) -> bool:
+    """
+    Only CC, or other services with the inter communication secret, can
+    export the clubs.
+    """
+    secret = request.headers.get(SECRET_HEADER)
+    if secret is not None and inter_communication_secret is not None:
+        return hmac.compare_digest(
+            secret.encode(), inter_communication_secret.encode()
+        )
+
+    # a malformed user header is treated as an anonymous request
+    try:
+        user = json.loads(request.headers.get("user", "{}"))
+    except ValueError:
+        return False
+    return isinstance(user, dict) and user.get("role") in ["cc"]
+
+
+async def _ndjson_lines(query: dict, projection: dict | None):
+    """Yields the matching documents in batches of NDJSON lines."""
+    cursor = clubsdb.find(query, projection, batch_size=EXPORT_BATCH_SIZE)
+    lines = []
+    async for document in cursor:
+        lines.append(
+            json_util.dumps(
+                document, json_options=json_util.RELAXED_JSON_OPTIONS
+            )
+        )
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def _gzipped(chunks: AsyncIterator[bytes]):
+    """Compresses a stream of chunks into a single gzip stream."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+@router.get("/clubs.ndjson")
+async def export_clubs(
+    request: Request,
+    state: EnumStates | None = None,
+    fields: str | None = None,
+    gzip: bool = False,
+):
+    """
+    Streams the clubs collection as NDJSON, one club document per line.
+
+    Access to only CC (Clubs Council) and other services.
+
+    Args:
+        request (Request): The incoming request.
+        state (models.EnumStates | None): Only export clubs in this state.
+                                          Defaults to None.
+        fields (str | None): Comma separated fields to export, all fields
+                             if not given. Defaults to None.
+        gzip (bool): Whether to gzip the response. Defaults to False.
+
+    Returns:
+        (StreamingResponse): The streamed documents.
+
+    Raises:
+        HTTPException: Not Authenticated to access this API.
+    """
+    if not _is_authorized(request):
+        raise HTTPException(
+            status_code=403, detail="Not Authenticated to access this API"
+        )
+
+    query = {} if state is None else {"state": state.value}
+    projection = None
+    if fields:
+        projection = {
+            field.strip(): 1 for field in fields.split(",") if field.strip()
+        }
+
+    body = _ndjson_lines(query, projection)
+    filename = "clubs.ndjson"
+    media_type = "application/x-ndjson"
+    if gzip:
+        body = _gzipped(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,158 @@
+"""
+Background File Cleanup
+
+This module provides a queue for deleting files from the files microservice
+in the background, so that mutations replacing a club's pictures don't wait
+on the deletion of the old ones. Deletions are run concurrently in batches,
+failed ones are retried with exponential backoff, and files that still
+could not be deleted are kept as orphans for later reconciliation.
+
+Orphans are only kept in the memory of the worker that gave up on them, and
+are lost when it restarts; every orphan is therefore also logged, so that
+the logs of all the workers remain the record to reconcile from.
+
+Attributes:
+    FILE_CLEANUP_BATCH_SIZE (int): Max deletions run concurrently.
+                                   Defaults to 10.
+    FILE_CLEANUP_MAX_ATTEMPTS (int): Attempts before a file is given up on.
+                                     Defaults to 5.
+    FILE_CLEANUP_RETRY_DELAY (float): Delay before the first retry in
+                                      seconds, doubled on every retry.
+                                      Defaults to 2.
+    FILE_CLEANUP_MAX_ORPHANS (int): Max number of orphans remembered.
+                                    Defaults to 1000.
+"""
+
+import asyncio
+from collections import deque
+from os import getenv
+
+from models import create_utc_time
+
+FILE_CLEANUP_BATCH_SIZE = int(getenv("FILE_CLEANUP_BATCH_SIZE", "10"))
+FILE_CLEANUP_MAX_ATTEMPTS = int(getenv("FILE_CLEANUP_MAX_ATTEMPTS", "5"))
+FILE_CLEANUP_RETRY_DELAY = float(getenv("FILE_CLEANUP_RETRY_DELAY", "2"))
+FILE_CLEANUP_MAX_ORPHANS = int(getenv("FILE_CLEANUP_MAX_ORPHANS", "1000"))
+
+
+class FileCleanupQueue:
+    """
+    Queue of files to be deleted by a background worker.
+
+    Attributes:
+        delete (Callable): Coroutine function deleting a file, called with
+                           the filename and a shared `httpx.AsyncClient`.
+        orphans (deque): Files that could not be deleted, most recent last,
+                         as dicts with the filename, error and time.
+        deleted (int): Number of files deleted.
+        retried (int): Number of deletions retried.
+    """
+
+    def __init__(self, delete):
+        self.delete = delete
+        self.orphans = deque(maxlen=FILE_CLEANUP_MAX_ORPHANS)
+        self.deleted = 0
+        self.retried = 0
+        self._queue = asyncio.Queue()
+        self._retries = {}
+        self._in_flight = []
+        self._worker = None
+
+    def enqueue(self, filename: str, attempt: int = 1):
+        """
+        Schedules a file for deletion, without waiting for it.
+
+        Args:
+            filename (str): Name of the file to be deleted.
+            attempt (int): The attempt this deletion will be. Defaults to 1.
+        """
+        self._queue.put_nowait((filename, attempt))
+
+    def start(self):
+        """Starts the background worker."""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5):
+        """
+        Stops the background worker, after giving it up to `timeout`
+        seconds to finish the queued deletions. Files still being deleted,
+        queued or waiting to be retried are recorded as orphans.
+        """
+        if self._worker is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        for filename, _ in self._in_flight:
+            self._orphan(filename, "Service stopped during deletion")
+        self._in_flight = []
+        for (filename, _), retry in self._retries.items():
+            retry.cancel()
+            self._orphan(filename, "Service stopped before retrying")
+        self._retries.clear()
+        while not self._queue.empty():
+            filename, _ = self._queue.get_nowait()
+            self._orphan(filename, "Service stopped before deletion")
+        self._worker = None
+
+    async def _run(self):
+        # httpx is only imported, and the client opened, once there is a
+        # file to be deleted, keeping them out of the worker's startup
+        # the batch being deleted is kept on the queue, to be recorded as
+        # orphans if the worker is stopped meanwhile
+        batch = self._in_flight = [await self._queue.get()]
+        from httpx import AsyncClient
+
+        async with AsyncClient() as client:
+            while True:
+                while (
+                    len(batch) < FILE_CLEANUP_BATCH_SIZE
+                    and not self._queue.empty()
+                ):
+                    batch.append(self._queue.get_nowait())
+
+                results = await asyncio.gather(
+                    *(self.delete(filename, client) for filename, _ in batch),
+                    return_exceptions=True,
+                )
+                for (filename, attempt), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        self._retry(filename, attempt, result)
+                    else:
+                        self.deleted += 1
+                    self._queue.task_done()
+
+                self._in_flight = []
+                batch = self._in_flight = [await self._queue.get()]
+
+    def _retry(self, filename: str, attempt: int, error: BaseException):
+        if attempt >= FILE_CLEANUP_MAX_ATTEMPTS:
+            self._orphan(filename, str(error))
+            return
+
+        self.retried += 1
+        delay = FILE_CLEANUP_RETRY_DELAY * 2 ** (attempt - 1)
+        self._retries[(filename, attempt + 1)] = (
+            asyncio.get_running_loop().call_later(
+                delay, self._requeue, filename, attempt + 1
+            )
+        )
+
+    def _requeue(self, filename: str, attempt: int):
+        self._retries.pop((filename, attempt), None)
+        self.enqueue(filename, attempt)
+
+    def _orphan(self, filename: str, error: str):
+        print(f"Orphaned file {filename}: {error}")
+        self.orphans.append(
+            {"filename": filename, "error": error, "time": create_utc_time()}
+        )
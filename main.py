@@ -9,27 +9,62 @@ Attributes:
     GLOBAL_DEBUG (str): Environment variable that Enables or Disables debug
                         mode. Defaults to "False".
     DEBUG (bool): Indicates whether the application is running in debug mode.
+    GRAPHQL_BATCH_MAX_OPERATIONS (int): Max operations in a batched request,
+                                        sent as a JSON array of operations
+                                        and executed concurrently.
+                                        Defaults to 10.
+    STARTUP_WARM_TIMEOUT (float): Seconds the startup waits for the worker to
+                                  become ready before serving anyway.
+                                  Defaults to 30.
+    CLUB_LISTS_REBUILD_INTERVAL (float): Seconds between the rebuilds of
+                                         the cached club lists, which are
+                                         otherwise patched in place when
+                                         clubs change. Defaults to 300.
+    readiness (dict): Readiness checks of the worker.
+    READY_CHECKS (tuple): Readiness checks the worker is ready once all of
+                          them pass, the indexes being ensured in the
+                          background without holding it up.
     gql_app (GraphQLRouter): The GraphQL router for handling GraphQL requests.
     app (FastAPI): The FastAPI application instance.
 """
 
+import asyncio
+import random
 from contextlib import asynccontextmanager
 from os import getenv
 
 import strawberry
 from fastapi import FastAPI
-from strawberry.extensions import DisableIntrospection, PydanticErrorExtension
+from fastapi.responses import JSONResponse, PlainTextResponse
+from strawberry.extensions import (
+    DisableIntrospection,
+    PydanticErrorExtension,
+    QueryDepthLimiter,
+)
 from strawberry.fastapi import GraphQLRouter
+from strawberry.schema.config import StrawberryConfig
 from strawberry.tools import create_type
 
+from admission import AdmissionMiddleware
+from cost import MAX_QUERY_DEPTH, CostAnalysisExtension
+
 # override PyObjectId and Context scalars
-from db import ensure_clubs_index
+from db import ensure_clubs_index, ping_mongo
+from deadline import DeadlineExtension
+from export import router as export_router
+from metrics import MetricsExtension, render_metrics
 from models import PyObjectId
 from mutations import mutations
 from otypes import Context, PyObjectIdType
+from profiling import SlowOperationExtension
 
 # import all queries and mutations
-from queries import queries
+from queries import queries, query_costs
+from ratelimit import RateLimitExtension
+from sessions import CausalSessionExtension
+from shared_cache import shared_cache
+from tracing import TracingExtension
+from utils import file_cleanup_queue, rebuild_club_lists, warm_club_caches
 
 # create query types
 Query = create_type("Query", queries)
@@ -40,6 +75,14 @@ Mutation = create_type("Mutation", mutations)
 # Strawberry extensions
 extensions = [
     PydanticErrorExtension,
+    SlowOperationExtension,
+    TracingExtension,
+    MetricsExtension,
+    QueryDepthLimiter(max_depth=MAX_QUERY_DEPTH),
+    CostAnalysisExtension.with_costs(query_costs),
+    RateLimitExtension,
+    DeadlineExtension,
+    CausalSessionExtension,
 ]
 
 
@@ -57,24 +100,105 @@ else:
         DisableIntrospection(),
     ]
 
+# every operation of a batch is limited, costed and rate limited on its own
+GRAPHQL_BATCH_MAX_OPERATIONS = int(
+    getenv("GRAPHQL_BATCH_MAX_OPERATIONS", "10")
+)
 
 schema = strawberry.federation.Schema(
     query=Query,
     mutation=Mutation,
     scalar_overrides={PyObjectId: PyObjectIdType},
     extensions=extensions,
+    config=StrawberryConfig(
+        batching_config={"max_operations": GRAPHQL_BATCH_MAX_OPERATIONS}
+    ),
 )
 
 # serve API with FastAPI router
 gql_app = GraphQLRouter(schema, context_getter=get_context)
 
 
+STARTUP_WARM_TIMEOUT = float(getenv("STARTUP_WARM_TIMEOUT", "30"))
+readiness = {"mongo": False, "indexes": False, "caches": False}
+READY_CHECKS = ("mongo", "caches")
+
+
+async def prepare_worker():
+    """
+    Checks MongoDB and warms the caches, retrying with backoff until the
+    worker is ready.
+    """
+    delay = 1
+    while not all(readiness[check] for check in READY_CHECKS):
+        readiness["mongo"] = await ping_mongo()
+        if readiness["mongo"] and not readiness["caches"]:
+            try:
+                count = await warm_club_caches()
+                readiness["caches"] = True
+                print(f"Warmed the caches with {count} clubs.")
+            except Exception as e:
+                print(f"Error in warming the caches: {e}")
+
+        if not all(readiness[check] for check in READY_CHECKS):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+async def prepare_indexes():
+    """
+    Ensures the indexes, retrying with backoff until they exist. Creating an
+    index can take long on a large collection, so requests are served in
+    the meantime.
+    """
+    delay = 1
+    while not await ensure_clubs_index():
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+    readiness["indexes"] = True
+
+
+CLUB_LISTS_REBUILD_INTERVAL = float(
+    getenv("CLUB_LISTS_REBUILD_INTERVAL", "300")
+)
+
+
+async def rebuild_club_lists_periodically():
+    """
+    Rebuilds the cached club lists from MongoDB every
+    `CLUB_LISTS_REBUILD_INTERVAL` seconds, reporting the ones that drifted.
+    """
+    while True:
+        # spread over time, so that the workers don't all read at once
+        await asyncio.sleep(
+            CLUB_LISTS_REBUILD_INTERVAL * random.uniform(0.9, 1.1)
+        )
+        try:
+            stale = await rebuild_club_lists()
+            if stale:
+                print(f"Rebuilt the club lists, {stale} of them were stale.")
+        except Exception as e:
+            print(f"Error in rebuilding the club lists: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    await ensure_clubs_index()
+    file_cleanup_queue.start()
+    shared_cache.start()
+    index_task = asyncio.create_task(prepare_indexes())
+    prepare_task = asyncio.create_task(prepare_worker())
+    rebuild_task = asyncio.create_task(rebuild_club_lists_periodically())
+    await asyncio.wait([prepare_task], timeout=STARTUP_WARM_TIMEOUT)
+    if not prepare_task.done():
+        print("Worker not ready yet, continuing startup in the background.")
     yield
     # Shutdown
+    prepare_task.cancel()
+    index_task.cancel()
+    rebuild_task.cancel()
+    await shared_cache.stop()
+    await file_cleanup_queue.stop()
 
 
 app = FastAPI(
@@ -83,4 +207,41 @@ app = FastAPI(
     desciption="Handles Data of Clubs",
     lifespan=lifespan,
 )
+app.add_middleware(AdmissionMiddleware)
 app.include_router(gql_app, prefix="/graphql")
+app.include_router(export_router, prefix="/export")
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe, passes as long as the worker is serving requests.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe, passes once MongoDB is reachable and the caches have
+    been warmed. Whether the indexes exist yet is reported as well.
+    """
+    checks = dict(readiness)
+    if all(checks[check] for check in READY_CHECKS):
+        checks["mongo"] = await ping_mongo()
+
+    ready = all(checks[check] for check in READY_CHECKS)
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "checks": checks},
+        status_code=200 if ready else 503,
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Serves the metrics of the worker in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4"
+    )
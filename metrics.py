@@ -0,0 +1,377 @@
+"""
+Prometheus Metrics
+
+This module collects the metrics of the clubs subgraph and renders them in
+the Prometheus text exposition format, served on `/metrics`. It covers:
+
+- the latency of every root resolver (`MetricsExtension`),
+- the MongoDB commands sent, with their latency (`MongoCommandMetrics`),
+- the requests sent to the gateway and the files microservice, with their
+  latency and errors, per helper in `utils` (`observe_outbound`),
+- the counters of the caches (including the tier shared by the workers),
+  circuit breakers, admission control and rate limiter, read when scraped.
+
+Recording a value only updates a couple of counters in a dict, so metrics
+are always on.
+
+Attributes:
+    LATENCY_BUCKETS (tuple): Upper bounds of the latency histograms' buckets
+                             in seconds.
+    registry (list): All the counters and histograms, in exposition order.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from inspect import isawaitable
+
+from pymongo import monitoring
+from strawberry.extensions import SchemaExtension
+
+from admission import admission_controller
+from breaker import breakers
+from cache import caches
+from ratelimit import rate_limiter
+from shared_cache import shared_cache
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+registry = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name,
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic counter, one per combination of label values.
+
+    Attributes:
+        name (str): Name of the metric.
+        help (str): Description of the metric.
+        labels (tuple): Names of the labels.
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        """Increments the counter of the given label values."""
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+        ]
+        for label_values, value in list(self._values.items()):
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram of observed values, one per combination of label values.
+
+    Attributes:
+        name (str): Name of the metric.
+        help (str): Description of the metric.
+        labels (tuple): Names of the labels.
+        buckets (tuple): Sorted upper bounds of the buckets.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        registry.append(self)
+
+    def observe(self, value: float, *label_values):
+        """Records a value for the given label values."""
+        series = self._values.get(label_values)
+        if series is None:
+            # counts per bucket (the last one being +Inf), and the sum
+            series = self._values[label_values] = [
+                [0] * (len(self.buckets) + 1),
+                0.0,
+            ]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for label_values, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.labels, label_values, f'le="{bound}"'
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+resolver_duration = Histogram(
+    "graphql_resolver_duration_seconds",
+    "Latency of the root resolvers.",
+    ("type", "field"),
+)
+resolver_errors = Counter(
+    "graphql_resolver_errors_total",
+    "Root resolvers that raised an error.",
+    ("type", "field"),
+)
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds",
+    "Latency of the MongoDB commands.",
+    ("command",),
+)
+mongo_command_errors = Counter(
+    "mongodb_command_errors_total",
+    "MongoDB commands that failed.",
+    ("command",),
+)
+outbound_duration = Histogram(
+    "outbound_request_duration_seconds",
+    "Latency of the requests to other services.",
+    ("service", "helper"),
+)
+outbound_errors = Counter(
+    "outbound_request_errors_total",
+    "Requests to other services that failed.",
+    ("service", "helper"),
+)
+
+
+class MetricsExtension(SchemaExtension):
+    """
+    Strawberry extension timing the root resolvers.
+    """
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        # only the root fields do any work, the others are plain attributes
+        if info.path.prev is not None:
+            return _next(root, info, *args, **kwargs)
+
+        labels = (info.parent_type.name, info.field_name)
+        start = time.perf_counter()
+        try:
+            result = _next(root, info, *args, **kwargs)
+        except Exception:
+            resolver_errors.inc(*labels)
+            resolver_duration.observe(time.perf_counter() - start, *labels)
+            raise
+
+        if isawaitable(result):
+            return self._observe(result, labels, start)
+        resolver_duration.observe(time.perf_counter() - start, *labels)
+        return result
+
+    async def _observe(self, result, labels: tuple, start: float):
+        try:
+            return await result
+        except Exception:
+            resolver_errors.inc(*labels)
+            raise
+        finally:
+            resolver_duration.observe(time.perf_counter() - start, *labels)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener recording the latency of every command.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration.observe(
+            event.duration_micros / 1e6, event.command_name
+        )
+
+    def failed(self, event):
+        mongo_command_errors.inc(event.command_name)
+        mongo_command_duration.observe(
+            event.duration_micros / 1e6, event.command_name
+        )
+
+
+@asynccontextmanager
+async def observe_outbound(service: str, helper: str):
+    """
+    Records the latency of a request to another service, and whether it
+    raised.
+
+    Args:
+        service (str): Name of the service called.
+        helper (str): Name of the helper sending the request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        outbound_errors.inc(service, helper)
+        raise
+    finally:
+        outbound_duration.observe(time.perf_counter() - start, service, helper)
+
+
+def _gauge(name: str, help: str, samples: list, kind: str = "gauge"):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(*labels)} {value}")
+    return lines
+
+
+def _component_metrics() -> list[str]:
+    """
+    Reads the counters kept by the caches, shared cache tier, breakers,
+    admission control and rate limiter.
+    """
+    lines = []
+    cache_labels = [(("cache",), (name,)) for name in caches]
+    cache_list = list(caches.values())
+    for counter in (
+        "hits",
+        "misses",
+        "evictions",
+        "expirations",
+        "rejections",
+    ):
+        lines += _gauge(
+            f"cache_{counter}_total",
+            f"Cache {counter}.",
+            [
+                (labels, getattr(cache, counter))
+                for labels, cache in zip(cache_labels, cache_list)
+            ],
+            kind="counter",
+        )
+    lines += _gauge(
+        "cache_entries",
+        "Entries in the cache.",
+        [
+            (labels, len(cache))
+            for labels, cache in zip(cache_labels, cache_list)
+        ],
+    )
+    lines += _gauge(
+        "cache_size_bytes",
+        "Approximate size of the cache.",
+        [
+            (labels, cache.currsize)
+            for labels, cache in zip(cache_labels, cache_list)
+        ],
+    )
+
+    for counter, value in shared_cache.stats().items():
+        lines += _gauge(
+            f"shared_cache_{counter}_total",
+            f"Shared cache tier {counter}.",
+            [(((), ()), value)],
+            kind="counter",
+        )
+
+    states = ("closed", "half_open", "open")
+    lines += _gauge(
+        "circuit_breaker_state",
+        "State of the circuit breaker, 0 closed, 1 half open, 2 open.",
+        [
+            ((("service",), (name,)), states.index(breaker.state))
+            for name, breaker in breakers.items()
+        ],
+    )
+    for counter in ("calls", "failures", "rejections", "opened"):
+        lines += _gauge(
+            f"circuit_breaker_{counter}_total",
+            f"Circuit breaker {counter}.",
+            [
+                ((("service",), (name,)), getattr(breaker, counter))
+                for name, breaker in breakers.items()
+            ],
+            kind="counter",
+        )
+
+    admission = admission_controller.stats()
+    for key, kind in (
+        ("in_flight", "gauge"),
+        ("queued", "gauge"),
+        ("admitted", "counter"),
+        ("shed", "counter"),
+    ):
+        name = f"admission_{key}" + ("_total" if kind == "counter" else "")
+        lines += _gauge(
+            name,
+            f"Admission control {key.replace('_', ' ')} requests.",
+            [(((), ()), admission[key])],
+            kind=kind,
+        )
+
+    lines += _gauge(
+        "rate_limited_operations_total",
+        "Operations rejected by the rate limiter.",
+        [(((), ()), rate_limiter.limited)],
+        kind="counter",
+    )
+    return lines
+
+
+def render_metrics() -> str:
+    """
+    Renders all the metrics in the Prometheus text exposition format.
+
+    Returns:
+        (str): The exposition.
+    """
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    lines += _component_metrics()
+    return "\n".join(lines) + "\n"
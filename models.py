@@ -172,6 +172,8 @@ class Club(BaseModel):
         socials (Social): Social Handles of the Club.
         created_time (datetime): Time of creation of the Club.
         updated_time (datetime): Time of last update to the Club.
+        version (int): Version of the Club, incremented by every write.
+                       Defaults to 0.
     """
 
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
@@ -204,6 +206,7 @@ class Club(BaseModel):
         default_factory=create_utc_time, frozen=True
     )
     updated_time: datetime = Field(default_factory=create_utc_time)
+    version: int = Field(0, ge=0, description="Version of the Club")
 
     # Validator
     @field_validator("email", mode="before")
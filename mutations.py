@@ -2,27 +2,41 @@
 Mutations for Clubs
 """
 
+from typing import List, Optional
+
 import strawberry
 from fastapi.encoders import jsonable_encoder
 
+from bulk import bulk_create_clubs, bulk_edit_clubs, parse_import
+from cache import caches
 from db import clubsdb
 from models import Club, create_utc_time
 
 # import all models and types
 from otypes import (
+    BulkClubResultType,
+    CacheStatsType,
+    EnumImportFormats,
     FullClubInput,
     FullClubType,
     Info,
     SimpleClubInput,
     SimpleClubType,
 )
+from records import ClubRecord
+from sessions import current_session
 from utils import (
     check_remove_old_file,
+    flush_caches,
     getUser,
-    invalidate_active_clubs_cache,
     invalidate_club_cache,
+    invalidate_missing_club_cache,
+    publish_club_record,
+    replace_club,
+    update_club,
     update_events_members_cid,
     update_role,
+    warm_club_caches,
 )
 
 
@@ -56,7 +70,9 @@ async def createClub(clubInput: FullClubInput, info: Info) -> SimpleClubType:
     if role in ["cc"]:
         club_input["cid"] = club_input["email"].split("@")[0]
 
-        cid_exists = await clubsdb.find_one({"cid": club_input["cid"]})
+        cid_exists = await clubsdb.find_one(
+            {"cid": club_input["cid"]}, session=current_session()
+        )
         if cid_exists:
             raise Exception("A club with this cid already exists")
 
@@ -65,19 +81,28 @@ async def createClub(clubInput: FullClubInput, info: Info) -> SimpleClubType:
         if clubMember is None:
             raise Exception("Invalid Club ID/Club Email")
 
-        code_exists = await clubsdb.find_one({"code": club_input["code"]})
+        code_exists = await clubsdb.find_one(
+            {"code": club_input["code"]}, session=current_session()
+        )
         if code_exists:
             raise Exception("A club with this short code already exists")
 
-        created_record = await clubsdb.insert_one(club_input)
+        created_record = await clubsdb.insert_one(
+            club_input, session=current_session()
+        )
         created_sample = Club.model_validate(
-            await clubsdb.find_one({"_id": created_record.inserted_id})
+            await clubsdb.find_one(
+                {"_id": created_record.inserted_id}, session=current_session()
+            )
         )
 
         if not await update_role(club_input["cid"], info.context.cookies):
             raise Exception("Error in updating the role for the club")
 
-        await invalidate_active_clubs_cache()
+        await invalidate_missing_club_cache(club_input["cid"])
+        await publish_club_record(
+            club_input["cid"], ClubRecord(created_sample)
+        )
 
         return SimpleClubType.from_pydantic(created_sample)
 
@@ -86,7 +111,9 @@ async def createClub(clubInput: FullClubInput, info: Info) -> SimpleClubType:
 
 
 @strawberry.mutation
-async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
+async def editClub(
+    clubInput: FullClubInput, info: Info, version: Optional[int] = None
+) -> FullClubType:
     """
     Mutation for editing of the club details either by that specific club or
     the cc
@@ -95,10 +122,14 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
     CC can edit any club details, but the club can only edit its own details.
     Only CC can change a clubs name/email and category.
 
+    The edit is written only if the club wasn't changed by someone else
+    since it was read, or since the given version when there is one.
 
     Args:
         clubInput (otypes.FullClubInput): Full details of the club to be updated to.
         info (otypes.Info): User metadata and cookies.
+        version (Optional[int]): Version of the club the edit is based on.
+                                 Defaults to None.
 
     Returns:
         (otypes.FullClubType): Full Details of the edited club.
@@ -113,6 +144,7 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
                    club. Please contact CC for it.
         Exception: Only CC is allowed to change the category of club.
         Exception: Not Authenticated to access this API.
+        GraphQLError: The club was changed by someone else.
     """  # noqa: E501
     user = info.context.user
     if user is None:
@@ -124,7 +156,9 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
     club_input = jsonable_encoder(clubInput.to_pydantic())
 
     if role in ["cc"]:
-        exists = await clubsdb.find_one({"code": club_input["code"]})
+        exists = await clubsdb.find_one(
+            {"code": club_input["code"]}, session=current_session()
+        )
         if not exists:
             raise Exception("A club with this code doesn't exist")
 
@@ -136,47 +170,19 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
         club_input["state"] = exists["state"]
         club_input["_id"] = exists["_id"]
 
+        result = await replace_club(exists, club_input, version)
+
         await check_remove_old_file(exists, club_input, "logo")
         await check_remove_old_file(exists, club_input, "banner")
         await check_remove_old_file(exists, club_input, "banner_square")
 
-        await clubsdb.replace_one({"code": club_input["code"]}, club_input)
-        if "socials" in club_input.keys():
-            await clubsdb.update_one(
-                {"code": club_input["code"]},
-                {
-                    "$set": {
-                        "socials.website": club_input["socials"]["website"],
-                        "socials.instagram": club_input["socials"][
-                            "instagram"
-                        ],
-                        "socials.facebook": club_input["socials"]["facebook"],
-                        "socials.youtube": club_input["socials"]["youtube"],
-                        "socials.twitter": club_input["socials"]["twitter"],
-                        "socials.linkedin": club_input["socials"]["linkedin"],
-                        "socials.discord": club_input["socials"]["discord"],
-                        "socials.whatsapp": club_input["socials"]["whatsapp"],
-                        "socials.other_links": club_input["socials"][
-                            "other_links"
-                        ],
-                    }
-                },
-            )
-        await clubsdb.update_one(
-            {"code": club_input["code"]},
-            {
-                "$set": {
-                    "created_time": exists["created_time"],
-                    "updated_time": create_utc_time(),
-                }
-            },
+        await publish_club_record(
+            club_input["cid"], ClubRecord(result), exists["cid"]
         )
 
-        await invalidate_club_cache(club_input["cid"])
-        await invalidate_active_clubs_cache()
-
         if exists["cid"] != club_input["cid"]:
             await invalidate_club_cache(exists["cid"])
+            await invalidate_missing_club_cache(club_input["cid"])
             return1 = await update_role(
                 exists["cid"], info.context.cookies, role="public"
             )
@@ -189,16 +195,15 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
             if not return1 or not return2 or not return3:
                 raise Exception("Error in updating the role/cid.")
 
-        result = Club.model_validate(
-            await clubsdb.find_one({"code": club_input["code"]})
-        )
         return FullClubType.from_pydantic(result)
 
     elif role in ["club"]:
         if uid != club_input["cid"]:
             raise Exception("Authentication Error! (CLUB ID CHANGED)")
 
-        exists = await clubsdb.find_one({"cid": club_input["cid"]})
+        exists = await clubsdb.find_one(
+            {"cid": club_input["cid"]}, session=current_session()
+        )
         if not exists:
             raise Exception("A club with this cid doesn't exist")
 
@@ -219,50 +224,14 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
         club_input["state"] = exists["state"]
         club_input["_id"] = exists["_id"]
 
+        result = await replace_club(exists, club_input, version)
+
         await check_remove_old_file(exists, club_input, "logo")
         await check_remove_old_file(exists, club_input, "banner")
         await check_remove_old_file(exists, club_input, "banner_square")
 
-        await clubsdb.replace_one({"cid": uid}, club_input)
-        if "socials" in club_input.keys():
-            await clubsdb.update_one(
-                {"cid": club_input["cid"]},
-                {
-                    "$set": {
-                        "socials.website": club_input["socials"]["website"],
-                        "socials.instagram": club_input["socials"][
-                            "instagram"
-                        ],
-                        "socials.facebook": club_input["socials"]["facebook"],
-                        "socials.youtube": club_input["socials"]["youtube"],
-                        "socials.twitter": club_input["socials"]["twitter"],
-                        "socials.linkedin": club_input["socials"]["linkedin"],
-                        "socials.discord": club_input["socials"]["discord"],
-                        "socials.whatsapp": club_input["socials"]["whatsapp"],
-                        "socials.other_links": club_input["socials"][
-                            "other_links"
-                        ],
-                    }
-                },
-            )
-
-        # also autofills the updated time
-        await clubsdb.update_one(
-            {"cid": club_input["cid"]},
-            {
-                "$set": {
-                    "created_time": exists["created_time"],
-                    "updated_time": create_utc_time(),
-                }
-            },
-        )
-
-        await invalidate_club_cache(club_input["cid"])
-        await invalidate_active_clubs_cache()
+        await publish_club_record(club_input["cid"], ClubRecord(result))
 
-        result = Club.model_validate(
-            await clubsdb.find_one({"cid": club_input["cid"]})
-        )
         return FullClubType.from_pydantic(result)
 
     else:
@@ -270,13 +239,17 @@ async def editClub(clubInput: FullClubInput, info: Info) -> FullClubType:
 
 
 @strawberry.mutation
-async def deleteClub(clubInput: SimpleClubInput, info: Info) -> SimpleClubType:
+async def deleteClub(
+    clubInput: SimpleClubInput, info: Info, version: Optional[int] = None
+) -> SimpleClubType:
     """
     Mutation for the cc to move a club to deleted state.
 
     Args:
         clubInput (otypes.SimpleClubInput): The club cid.
         info (otypes.Info): User metadata and cookies.
+        version (Optional[int]): Version of the club the change is based on,
+                                 if any. Defaults to None.
 
     Returns:
         (otypes.SimpleClubType): Details of the deleted club.
@@ -284,6 +257,8 @@ async def deleteClub(clubInput: SimpleClubInput, info: Info) -> SimpleClubType:
     Raises:
         Exception: Not Authenticated.
         Exception: Not Authenticated to access this API.
+        Exception: A club with this cid doesn't exist.
+        GraphQLError: The club was changed by someone else.
     """
     user = info.context.user
     if user is None:
@@ -295,27 +270,22 @@ async def deleteClub(clubInput: SimpleClubInput, info: Info) -> SimpleClubType:
     if role not in ["cc"]:
         raise Exception("Not Authenticated to access this API")
 
-    # also autofills the updated time
-    await clubsdb.update_one(
-        {"cid": club_input["cid"]},
-        {"$set": {"state": "deleted", "updated_time": create_utc_time()}},
+    updated_sample = await update_club(
+        club_input["cid"],
+        {"state": "deleted", "updated_time": create_utc_time()},
+        version,
     )
 
     await update_role(club_input["cid"], info.context.cookies, "public")
 
-    updated_sample = Club.model_validate(
-        await clubsdb.find_one({"cid": club_input["cid"]})
-    )
-
-    await invalidate_active_clubs_cache()
-    await invalidate_club_cache(club_input["cid"])
+    await publish_club_record(club_input["cid"], ClubRecord(updated_sample))
 
     return SimpleClubType.from_pydantic(updated_sample)
 
 
 @strawberry.mutation
 async def restartClub(
-    clubInput: SimpleClubInput, info: Info
+    clubInput: SimpleClubInput, info: Info, version: Optional[int] = None
 ) -> SimpleClubType:
     """
     Mutation for cc to move a club from deleted state to active state.
@@ -323,6 +293,8 @@ async def restartClub(
     Args:
         clubInput (otypes.SimpleClubInput): The club cid.
         info (otypes.Info): User metadata and cookies.
+        version (Optional[int]): Version of the club the change is based on,
+                                 if any. Defaults to None.
 
     Returns:
         (otypes.SimpleClubType): Details of the restarted clubs cid.
@@ -330,6 +302,8 @@ async def restartClub(
     Raises:
         Exception: Not Authenticated.
         Exception: Not Authenticated to access this API.
+        Exception: A club with this cid doesn't exist.
+        GraphQLError: The club was changed by someone else.
     """
     user = info.context.user
     if user is None:
@@ -341,28 +315,199 @@ async def restartClub(
     if role not in ["cc"]:
         raise Exception("Not Authenticated to access this API")
 
-    # also autofills the updated time
-    await clubsdb.update_one(
-        {"cid": club_input["cid"]},
-        {"$set": {"state": "active", "updated_time": create_utc_time()}},
+    updated_sample = await update_club(
+        club_input["cid"],
+        {"state": "active", "updated_time": create_utc_time()},
+        version,
     )
 
     await update_role(club_input["cid"], info.context.cookies, "club")
 
-    updated_sample = Club.model_validate(
-        await clubsdb.find_one({"cid": club_input["cid"]})
-    )
-
-    await invalidate_active_clubs_cache()
-    await invalidate_club_cache(club_input["cid"])
+    await publish_club_record(club_input["cid"], ClubRecord(updated_sample))
+    await invalidate_missing_club_cache(club_input["cid"])
 
     return SimpleClubType.from_pydantic(updated_sample)
 
 
+@strawberry.mutation
+async def bulkCreateClubs(
+    clubInputs: List[FullClubInput], info: Info
+) -> List[BulkClubResultType]:
+    """
+    Mutation for creation of many new clubs at once by CC.
+
+    Every club is validated and created like in `createClub`, but the
+    lookups and writes of all clubs are batched. A failing club doesn't
+    stop the others from being created.
+
+    Args:
+        clubInputs (List[otypes.FullClubInput]): Full details of the clubs.
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.BulkClubResultType]): Result for each club, in order.
+
+    Raises:
+        Exception: Not Authenticated.
+        Exception: Not Authenticated to access this API.
+        Exception: Too many clubs sent at once.
+    """
+    user = info.context.user
+    if user is None:
+        raise Exception("Not Authenticated")
+
+    if user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return await bulk_create_clubs(clubInputs, info.context.cookies)
+
+
+@strawberry.mutation
+async def bulkEditClubs(
+    clubInputs: List[FullClubInput], info: Info
+) -> List[BulkClubResultType]:
+    """
+    Mutation for editing of many clubs at once by CC.
+
+    Every club is validated and edited like CC does in `editClub`, but the
+    lookups and writes of all clubs are batched. A failing club doesn't
+    stop the others from being edited.
+
+    Args:
+        clubInputs (List[otypes.FullClubInput]): Full details of the clubs
+            to be updated to.
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.BulkClubResultType]): Result for each club, in order.
+
+    Raises:
+        Exception: Not Authenticated.
+        Exception: Not Authenticated to access this API.
+        Exception: Too many clubs sent at once.
+    """
+    user = info.context.user
+    if user is None:
+        raise Exception("Not Authenticated")
+
+    if user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return await bulk_edit_clubs(clubInputs, info.context.cookies)
+
+
+@strawberry.mutation
+async def importClubs(
+    data: str,
+    dataFormat: EnumImportFormats,
+    info: Info,
+    edit: bool = False,
+) -> List[BulkClubResultType]:
+    """
+    Mutation for CC to create or edit clubs from JSON or CSV data.
+
+    See `bulk.parse_import` for the expected layout of the data.
+
+    Args:
+        data (str): The clubs to be imported.
+        dataFormat (otypes.EnumImportFormats): Format of the data.
+        info (otypes.Info): User metadata and cookies.
+        edit (bool): If true, edits existing clubs instead of creating
+            new ones. Defaults to False.
+
+    Returns:
+        (List[otypes.BulkClubResultType]): Result for each club, in order.
+
+    Raises:
+        Exception: Not Authenticated.
+        Exception: Not Authenticated to access this API.
+        Exception: Invalid data.
+        Exception: Too many clubs sent at once.
+    """
+    user = info.context.user
+    if user is None:
+        raise Exception("Not Authenticated")
+
+    if user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    try:
+        rows = parse_import(data, dataFormat)
+    except Exception as e:
+        raise Exception(f"Invalid data: {e}")
+
+    if edit:
+        return await bulk_edit_clubs(rows, info.context.cookies)
+    return await bulk_create_clubs(rows, info.context.cookies)
+
+
+@strawberry.mutation
+async def flushCaches(
+    info: Info, names: Optional[List[str]] = None
+) -> List[CacheStatsType]:
+    """
+    Mutation for cc to empty the caches of every worker, and the cache tier
+    shared by them.
+
+    Args:
+        info (otypes.Info): User metadata and cookies.
+        names (Optional[List[str]]): Names of the caches to be flushed.
+            Defaults to None, which flushes all caches.
+
+    Returns:
+        (List[otypes.CacheStatsType]): Stats of the flushed caches.
+
+    Raises:
+        Exception: Not Authenticated.
+        Exception: Not Authenticated to access this API.
+    """
+    user = info.context.user
+    if user is None:
+        raise Exception("Not Authenticated")
+
+    if user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return [CacheStatsType(**stats) for stats in await flush_caches(names)]
+
+
+@strawberry.mutation
+async def warmCaches(info: Info) -> List[CacheStatsType]:
+    """
+    Mutation for cc to preload the active clubs into the caches of this
+    worker.
+
+    Args:
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.CacheStatsType]): Stats of all caches after warming.
+
+    Raises:
+        Exception: Not Authenticated.
+        Exception: Not Authenticated to access this API.
+    """
+    user = info.context.user
+    if user is None:
+        raise Exception("Not Authenticated")
+
+    if user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    await warm_club_caches()
+
+    return [CacheStatsType(**cache.stats()) for cache in caches.values()]
+
+
 # register all mutations
 mutations = [
     createClub,
     editClub,
     deleteClub,
     restartClub,
+    bulkCreateClubs,
+    bulkEditClubs,
+    importClubs,
+    flushCaches,
+    warmCaches,
 ]
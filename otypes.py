@@ -3,6 +3,9 @@ Types and Inputs for clubs subgraph
 """
 
 import json
+import time
+from datetime import datetime
+from enum import Enum
 from functools import cached_property
 from typing import Dict, List, Optional, Union
 
@@ -11,16 +14,25 @@ from strawberry.fastapi import BaseContext
 from strawberry.types import Info as _Info
 from strawberry.types.info import RootValueType
 
+from deadline import deadline_from_headers
 from models import Club, PyObjectId, Social
 
 
 # custom context class
 class Context(BaseContext):
     """
-    Class provides user metadata and cookies from request headers, has
-    methods for doing this.
+    Class provides user metadata, cookies and the deadline of the request
+    from request headers, has methods for doing this.
+
+    The context is shared by all the operations of a batched request, along
+    with the lookups they make (see `utils.shared_load`).
     """
 
+    def __init__(self):
+        super().__init__()
+        self.started_at = time.monotonic()
+        self.loads = {}
+
     @cached_property
     def user(self) -> Union[Dict, None]:
         if not self.request:
@@ -37,6 +49,11 @@ class Context(BaseContext):
         cookies = json.loads(self.request.headers.get("cookies", "{}"))
         return cookies
 
+    @cached_property
+    def deadline(self) -> float:
+        headers = self.request.headers if self.request else None
+        return deadline_from_headers(headers, self.started_at)
+
 
 Info = _Info[Context, RootValueType]
 """custom info Type for user metadata"""
@@ -94,6 +111,7 @@ class SimpleClubType:
         banner_square (Optional[str]): Club SquareBanner URL. Defaults to None.
         name (str): Name of the Club.
         tagline (Optional[str]): Tagline of the Club. Defaults to None.
+        version (int): Version of the Club, to be sent back with edits.
     """
 
     id: strawberry.auto
@@ -107,6 +125,7 @@ class SimpleClubType:
     banner_square: strawberry.auto
     name: strawberry.auto
     tagline: strawberry.auto
+    version: strawberry.auto
 
 
 @strawberry.experimental.pydantic.type(model=Club)
@@ -128,6 +147,7 @@ class FullClubType:
         tagline (Optional[str]): Tagline of the Club. Defaults to None.
         description (Optional[str]): Club Description. Defaults to None.
         socials (SocialsType): Social Handles of the Club.
+        version (int): Version of the Club, to be sent back with edits.
     """
 
     id: strawberry.auto
@@ -143,6 +163,105 @@ class FullClubType:
     tagline: strawberry.auto
     description: strawberry.auto
     socials: strawberry.auto
+    version: strawberry.auto
+
+
+@strawberry.type
+class CacheStatsType:
+    """
+    Type used for return of the size and counters of an in-process cache.
+
+    Attributes:
+        name (str): Name of the cache.
+        entries (int): Number of entries in the cache.
+        size_bytes (int): Approximate memory used by the entries.
+        max_bytes (int): Memory budget of the cache.
+        ttl (float): Default time to live of an entry, in seconds.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found in the cache.
+        hit_ratio (float): Fraction of lookups served from the cache.
+        evictions (int): Number of entries evicted to stay within budget.
+        expirations (int): Number of entries removed after their ttl.
+        rejections (int): Number of values too large to be cached at all.
+    """
+
+    name: str
+    entries: int
+    size_bytes: int
+    max_bytes: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    expirations: int
+    rejections: int
+
+
+@strawberry.type
+class CircuitBreakerType:
+    """
+    Type used for return of the state and counters of a circuit breaker.
+
+    Attributes:
+        name (str): Name of the downstream service.
+        state (str): One of "closed", "open" and "half_open".
+        timeout (float): Timeout for calls to the service, in seconds.
+        calls (int): Number of calls let through.
+        failures (int): Number of calls that failed.
+        rejections (int): Number of calls failed fast.
+        opened (int): Number of times the circuit opened.
+    """
+
+    name: str
+    state: str
+    timeout: float
+    calls: int
+    failures: int
+    rejections: int
+    opened: int
+
+
+@strawberry.type
+class BulkClubResultType:
+    """
+    Type used for return of the outcome of one row of a bulk operation.
+
+    Attributes:
+        row (int): Index of the row in the input, starting from 0.
+        cid (Optional[str]): the Club ID, if it could be determined.
+        success (bool): Whether the row was applied completely.
+        error (Optional[str]): Reason for failure. Defaults to None.
+    """
+
+    row: int
+    cid: Optional[str]
+    success: bool
+    error: Optional[str] = None
+
+
+@strawberry.type
+class OrphanFileType:
+    """
+    Type used for return of a file that could not be deleted.
+
+    Attributes:
+        filename (str): Name of the file in the files microservice.
+        error (str): Error from the last attempt to delete it.
+        time (datetime): Time at which the file was given up on.
+    """
+
+    filename: str
+    error: str
+    time: datetime
+
+
+@strawberry.enum
+class EnumImportFormats(str, Enum):
+    """Enum for format of the data of clubs to be imported."""
+
+    json = "json"
+    csv = "csv"
 
 
 # CLUBS INPUTS
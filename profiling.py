@@ -0,0 +1,209 @@
+"""
+Slow Operation Log and On-demand Profiling
+
+This module provides a Strawberry extension timing every GraphQL operation
+phase by phase (parse, validate and resolve, the time spent outside them,
+e.g. in other extensions, being logged as other), and counting the
+MongoDB commands it sent. Operations slower than `SLOW_OPERATION_THRESHOLD`
+are logged with their name, the shape of their variables (never their
+values), the number of MongoDB commands and the time of every phase.
+
+In debug mode, sending the `X-Profile` header with a request runs a
+sampling profiler while it executes, and returns the sampled stacks in the
+`profile` entry of the response's extensions, most frequent first. The
+profiler samples the event loop's thread, so concurrent requests show up
+in the profile as well.
+
+Attributes:
+    SLOW_OPERATION_THRESHOLD (float): Seconds after which an operation is
+                                      logged as slow. Defaults to 1.
+    PROFILE_HEADER (str): Header turning on the profiler for a request.
+    PROFILE_INTERVAL (float): Seconds between two samples of the profiler.
+                              Defaults to 0.001.
+    PROFILE_MAX_STACKS (int): Max stacks returned in a profile.
+                              Defaults to 50.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from os import getenv
+
+from pymongo import monitoring
+from strawberry.extensions import SchemaExtension
+
+SLOW_OPERATION_THRESHOLD = float(getenv("SLOW_OPERATION_THRESHOLD", "1"))
+PROFILE_HEADER = "x-profile"
+PROFILE_INTERVAL = float(getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_MAX_STACKS = int(getenv("PROFILE_MAX_STACKS", "50"))
+
+DEBUG = getenv("GLOBAL_DEBUG", "False").lower() in ("true", "1", "t")
+
+logger = logging.getLogger("clubs.slow_operations")
+
+# MongoDB commands sent by the current operation, in a list so that the
+# tasks of its resolvers add to the same count
+_mongo_commands = ContextVar("mongo_commands", default=None)
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """
+    pymongo command listener counting the commands of every operation.
+    """
+
+    def started(self, event):
+        commands = _mongo_commands.get()
+        if commands is not None:
+            commands[0] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def variables_shape(value):
+    """
+    Replaces every value of the variables by the name of its type, lists
+    being described by their first item.
+
+    Args:
+        value (Any): The variables of an operation.
+
+    Returns:
+        (Any): The shape of the variables.
+    """
+    if isinstance(value, dict):
+        return {key: variables_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [variables_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread at a regular interval from another one.
+
+    Attributes:
+        thread_id (int): Id of the sampled thread.
+        interval (float): Seconds between two samples.
+        stacks (collections.Counter): Number of samples of every stack,
+                                      in the collapsed `caller;callee`
+                                      format.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        """
+        Stops sampling.
+
+        Returns:
+            (dict): The number of samples, the interval and the most
+                    sampled stacks.
+        """
+        self._stopped.set()
+        self._thread.join()
+        return {
+            "samples": sum(self.stacks.values()),
+            "interval": self.interval,
+            "stacks": [
+                {"stack": stack, "samples": samples}
+                for stack, samples in self.stacks.most_common(
+                    PROFILE_MAX_STACKS
+                )
+            ],
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                module = frame.f_globals.get("__name__", "?")
+                names.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+class SlowOperationExtension(SchemaExtension):
+    """
+    Strawberry extension logging slow operations and profiling requests
+    asking for it in debug mode.
+    """
+
+    def on_operation(self):
+        self.phases = {}
+        self.profile = None
+        commands = [0]
+        token = _mongo_commands.set(commands)
+
+        profiler = None
+        request = self.execution_context.context.request
+        if DEBUG and request is not None and PROFILE_HEADER in request.headers:
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - start
+            _mongo_commands.reset(token)
+            if profiler is not None:
+                self.profile = profiler.stop()
+
+        self.phases["other"] = max(0.0, total - sum(self.phases.values()))
+        if total >= SLOW_OPERATION_THRESHOLD:
+            execution_context = self.execution_context
+            logger.warning(
+                "Slow operation %s took %.3fs: %s",
+                execution_context.operation_name,
+                total,
+                json.dumps(
+                    {
+                        "variables": variables_shape(
+                            execution_context.variables or {}
+                        ),
+                        "mongo_commands": commands[0],
+                        "phases": {
+                            phase: round(seconds, 6)
+                            for phase, seconds in self.phases.items()
+                        },
+                    }
+                ),
+            )
+
+    def _timed(self, phase: str):
+        start = time.perf_counter()
+        yield
+        self.phases[phase] = time.perf_counter() - start
+
+    def on_parse(self):
+        yield from self._timed("parse")
+
+    def on_validate(self):
+        yield from self._timed("validate")
+
+    def on_execute(self):
+        yield from self._timed("resolve")
+
+    def get_results(self) -> dict:
+        if self.profile is None:
+            return {}
+        return {"profile": self.profile}
@@ -2,27 +2,131 @@
 Queries for Clubs
 """
 
-from typing import List
+from typing import List, Optional
 
+import bson
 import strawberry
 from fastapi.encoders import jsonable_encoder
 
-from db import clubsdb
-from models import Club
+from breaker import breakers
+from cache import caches
+from db import clubsdb, public_clubsdb
+from models import Club, EnumCategories
 
 # import all models and types
-from otypes import FullClubType, Info, SimpleClubInput, SimpleClubType
+from otypes import (
+    CacheStatsType,
+    CircuitBreakerType,
+    FullClubType,
+    Info,
+    OrphanFileType,
+    SimpleClubInput,
+    SimpleClubType,
+)
+from records import (
+    LIST_PROJECTION,
+    ClubRecord,
+    decode_club_list,
+    encode_club_list,
+)
+from sessions import read_session
+from shared_cache import shared_cache
 from utils import (
     active_clubs_cache,
     active_clubs_lock,
+    cache_club_record,
     club_cache,
     club_cache_lock,
+    club_caches_generation,
+    club_lists_cache,
+    club_lists_lock,
+    file_cleanup_queue,
+    missing_club_cache,
+    missing_club_cache_lock,
+    shared_load,
 )
 
 
+async def _read_club_records(
+    is_admin: bool, category: str | None = None
+) -> tuple:
+    """
+    Reads the records of all the clubs for CC, or of the active clubs (of
+    the given category, if any) for the public.
+    """
+    # only the fields served are read, and the documents, validated when
+    # written, are not validated again, lists being read in `_id` order
+    if is_admin:
+        results = (
+            await clubsdb.find({}, LIST_PROJECTION)
+            .sort("_id", 1)
+            .to_list(length=None)
+        )
+        return tuple(ClubRecord.from_document(result) for result in results)
+
+    if category is not None:
+        async with read_session() as session:
+            results = (
+                await public_clubsdb.find(
+                    {"state": "active", "category": category},
+                    LIST_PROJECTION,
+                    session=session,
+                )
+                .sort("_id", 1)
+                .to_list(length=None)
+            )
+        return tuple(ClubRecord.from_document(result) for result in results)
+
+    # the active clubs may have been read by another worker
+    shared = await shared_cache.get("active_clubs", "active_clubs")
+    if shared is not None:
+        return decode_club_list(shared)
+
+    # public reads may be served by a secondary
+    async with read_session() as session:
+        results = (
+            await public_clubsdb.find(
+                {"state": "active"}, LIST_PROJECTION, session=session
+            )
+            .sort("_id", 1)
+            .to_list(length=None)
+        )
+
+    records = tuple(ClubRecord.from_document(result) for result in results)
+    await shared_cache.fill(
+        "active_clubs",
+        "active_clubs",
+        encode_club_list(records),
+        active_clubs_cache.ttl,
+    )
+    return records
+
+
+async def _read_club(cid: str, is_admin: bool) -> dict | None:
+    """
+    Reads the document of a club, from the shared cache tier if another
+    worker read it, else from MongoDB (a secondary for the public).
+    """
+    shared = await shared_cache.get("club", cid)
+    if shared is not None:
+        return bson.decode(shared)
+
+    collection = clubsdb if is_admin else public_clubsdb
+    async with read_session() as session:
+        club = await collection.find_one(
+            {"cid": cid}, {"_id": 0}, session=session
+        )
+
+    if club is not None:
+        await shared_cache.fill("club", cid, bson.encode(club), club_cache.ttl)
+    return club
+
+
 @strawberry.field
 async def allClubs(
-    info: Info, onlyActive: bool = False
+    info: Info,
+    onlyActive: bool = False,
+    category: Optional[EnumCategories] = None,
 ) -> List[SimpleClubType]:
     """
     Fetches all the clubs
@@ -32,12 +136,16 @@ async def allClubs(
     it returns only the active clubs.
     Access to both public and CC (Clubs Council).
 
-    Note: The results are cached for public access.
+    Note: The lists are cached, the public active clubs list, CC's list and
+    the public lists of every category separately, and patched when a club
+    changes. Public reads may be served by a secondary.
 
     Args:
         info (otypes.Info): User metadata and cookies.
         onlyActive (bool): If true, returns only active clubs.
             Default is False.
+        category (Optional[models.EnumCategories]): If given, returns only
+            the clubs of this category. Default is None.
 
     Returns:
         (List[otypes.SimpleClubType]): List of all clubs.
@@ -45,30 +153,39 @@ async def allClubs(
     user = info.context.user
     is_admin = user is not None and user["role"] in ["cc"] and not onlyActive
 
-    # For public, serve from cache if available
-    if not is_admin:
-        async with active_clubs_lock.reader_lock:
-            if "active_clubs" in active_clubs_cache:
-                return active_clubs_cache["active_clubs"]
-
-    results = []
+    # CC's list is filtered by category, the public has a list per category
+    read_category = None
     if is_admin:
-        results = await clubsdb.find().to_list(length=None)
+        cache, lock, key = club_lists_cache, club_lists_lock, "all"
+    elif category is not None:
+        cache, lock = club_lists_cache, club_lists_lock
+        key = read_category = category.value
     else:
-        results = await clubsdb.find({"state": "active"}, {"_id": 0}).to_list(
-            length=None
+        cache, lock = active_clubs_cache, active_clubs_lock
+        key = "active_clubs"
+
+    # serve from cache if available
+    async with lock.reader_lock:
+        records = cache.get(key)
+
+    if records is None:
+        # the operations of a batch share the read
+        records, generation = await shared_load(
+            info.context,
+            ("allClubs", key),
+            _read_club_records,
+            is_admin,
+            read_category,
         )
 
-    clubs = []
-    for result in results:
-        clubs.append(SimpleClubType.from_pydantic(Club.model_validate(result)))
-
-    # Update the cache if not admin
-    if not is_admin:
-        async with active_clubs_lock.writer_lock:
-            active_clubs_cache["active_clubs"] = clubs
+        # update the cache, unless invalidated since the read
+        async with lock.writer_lock:
+            if generation == club_caches_generation():
+                cache.set(key, records)
 
-    return clubs
+    if is_admin and category is not None:
+        records = [record for record in records if record.category == category]
+    return [record.to_simple_type() for record in records]
 
 
 @strawberry.field
@@ -80,7 +197,9 @@ async def club(clubInput: SimpleClubInput, info: Info) -> FullClubType:
     Returns deleted clubs also for CC and not for public.
     Accessible to both public and CC(Clubs Council).
 
-    Note: The results are cached for public access.
+    Note: The results are cached, deleted clubs being served from the cache
+    to CC only. Lookups of missing or deleted clubs are also cached for a
+    short time.
 
     Args:
         clubInput (otypes.SimpleClubInput): The club cid.
@@ -99,20 +218,39 @@ async def club(clubInput: SimpleClubInput, info: Info) -> FullClubType:
     club_input = jsonable_encoder(clubInput)
     cid = club_input["cid"].lower()
 
-    # serve from cache if available for public
-    if not is_admin:
-        async with club_cache_lock.reader_lock:
-            if cid in club_cache:
-                return club_cache[cid]
+    # serve from cache if available, deleted clubs only for admin
+    async with club_cache_lock.reader_lock:
+        cached_club = club_cache.get(cid)
+    if cached_club is not None:
+        if cached_club.is_deleted and not is_admin:
+            raise Exception("No Club Found")
+        return cached_club.to_full_type()
+
+    # fail fast on cids recently found to be missing or deleted
+    async with missing_club_cache_lock.reader_lock:
+        missing_reason = missing_club_cache.get(cid)
+    if missing_reason == "not found" or (
+        missing_reason == "deleted" and not is_admin
+    ):
+        raise Exception("No Club Found")
 
     result = None
-    club = await clubsdb.find_one({"cid": cid}, {"_id": 0})
+    club, generation = await shared_load(
+        info.context, ("club", cid, is_admin), _read_club, cid, is_admin
+    )
 
     if not club:
+        async with missing_club_cache_lock.writer_lock:
+            if generation == club_caches_generation():
+                missing_club_cache.set(cid, "not found")
         raise Exception("No Club Found")
 
     # check if club is deleted
     if club["state"] == "deleted":
+        async with missing_club_cache_lock.writer_lock:
+            if generation == club_caches_generation():
+                missing_club_cache.set(cid, "deleted")
+
         # if deleted, check if requesting user is admin
         if is_admin:
             result = Club.model_validate(club)
@@ -126,20 +264,107 @@ async def club(clubInput: SimpleClubInput, info: Info) -> FullClubType:
         result = Club.model_validate(club)
 
     if result:
-        full_club = FullClubType.from_pydantic(result)
+        record = ClubRecord(result)
+        await cache_club_record(cid, record, generation)
 
-        # cache the club if not admin and not deleted
-        if not is_admin and club["state"] != "deleted":
-            async with club_cache_lock.writer_lock:
-                club_cache[cid] = full_club
-
-        return full_club
+        return record.to_full_type()
     else:
         raise Exception("No Club Result Found")
 
 
+@strawberry.field
+def cacheStats(info: Info) -> List[CacheStatsType]:
+    """
+    Fetches the size and hit/miss/eviction counters of all in-process caches
+
+    Access to only CC (Clubs Council).
+
+    Args:
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.CacheStatsType]): Stats of every cache of this worker.
+
+    Raises:
+        Exception: Not Authenticated to access this API.
+    """
+    user = info.context.user
+    if user is None or user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return [CacheStatsType(**cache.stats()) for cache in caches.values()]
+
+
+@strawberry.field
+def circuitBreakers(info: Info) -> List[CircuitBreakerType]:
+    """
+    Fetches the state of the circuit breakers of the downstream services
+
+    Access to only CC (Clubs Council).
+
+    Args:
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.CircuitBreakerType]): State of every breaker of this
+                                           worker.
+
+    Raises:
+        Exception: Not Authenticated to access this API.
+    """
+    user = info.context.user
+    if user is None or user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return [
+        CircuitBreakerType(**breaker.stats()) for breaker in breakers.values()
+    ]
+
+
+@strawberry.field
+def orphanFiles(info: Info) -> List[OrphanFileType]:
+    """
+    Fetches the old club files that could not be deleted
+
+    Used to reconcile the files microservice with the clubs, as old
+    pictures are deleted in the background.
+    Access to only CC (Clubs Council).
+
+    Note: Orphans are kept in memory by every worker, so only those of the
+    worker serving the request, since it started, are returned. All of them
+    are also logged.
+
+    Args:
+        info (otypes.Info): User metadata and cookies.
+
+    Returns:
+        (List[otypes.OrphanFileType]): Files that this worker gave up on.
+
+    Raises:
+        Exception: Not Authenticated to access this API.
+    """
+    user = info.context.user
+    if user is None or user["role"] not in ["cc"]:
+        raise Exception("Not Authenticated to access this API")
+
+    return [OrphanFileType(**orphan) for orphan in file_cleanup_queue.orphans]
+
+
 # register all queries
 queries = [
     allClubs,
     club,
+    cacheStats,
+    circuitBreakers,
+    orphanFiles,
 ]
+
+# cost of every query, scans of the collection costing more than lookups
+# served from the caches (see cost.CostAnalysisExtension)
+query_costs = {
+    "allClubs": 10,
+    "club": 2,
+    "cacheStats": 1,
+    "circuitBreakers": 1,
+    "orphanFiles": 1,
+}
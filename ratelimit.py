@@ -0,0 +1,186 @@
+"""
+Per-client Rate Limiting
+
+This module provides token bucket rate limiting for GraphQL operations.
+Every client gets a bucket for queries and a separate one for mutations,
+refilled at a steady rate up to a burst size. Clients are identified by
+their uid when logged in, and by their IP address otherwise. The
+`X-Forwarded-For` header, which clients can set to anything, is only
+trusted when the request comes from one of the `TRUSTED_PROXIES` (e.g.
+the gateway), and then only for the addresses added by those proxies.
+Buckets are kept in an LRU cache, so memory stays bounded however many
+clients there are.
+
+Operations over the limit are rejected with a GraphQL error whose
+extensions carry the code `RATE_LIMITED` and a `retryAfter` hint in
+seconds.
+
+Attributes:
+    QUERY_RATE (float): Queries per second allowed per client.
+                        Defaults to 10.
+    QUERY_BURST (float): Max queries a client can send at once.
+                         Defaults to 50.
+    MUTATION_RATE (float): Mutations per second allowed per client.
+                           Defaults to 1.
+    MUTATION_BURST (float): Max mutations a client can send at once.
+                            Defaults to 10.
+    RATE_LIMIT_MAX_CLIENTS (int): Max clients whose buckets are kept.
+                                  Defaults to 10000.
+    TRUSTED_PROXIES (tuple): Networks of the proxies whose
+                             `X-Forwarded-For` is trusted, from a comma
+                             separated list of addresses or CIDRs.
+                             Defaults to none.
+"""
+
+import ipaddress
+import math
+import time
+from os import getenv
+
+from cachetools import LRUCache
+from graphql import ExecutionResult, GraphQLError
+from strawberry.extensions import SchemaExtension
+from strawberry.types.graphql import OperationType
+
+QUERY_RATE = float(getenv("QUERY_RATE", "10"))
+QUERY_BURST = float(getenv("QUERY_BURST", "50"))
+MUTATION_RATE = float(getenv("MUTATION_RATE", "1"))
+MUTATION_BURST = float(getenv("MUTATION_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in getenv("TRUSTED_PROXIES", "").split(",")
+    if proxy.strip()
+)
+
+
+class TokenBucket:
+    """
+    Tokens of one client for one kind of operation.
+
+    Attributes:
+        tokens (float): Tokens left.
+        updated (float): Time at which the tokens were last refilled.
+    """
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """
+        Takes a token if there is one.
+
+        Returns:
+            (float): 0 if a token was taken, else the seconds after which
+                     the next token will be available.
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class RateLimiter:
+    """
+    Token buckets of all clients, for queries and mutations.
+    """
+
+    def __init__(self, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.limits = {
+            OperationType.QUERY: (QUERY_RATE, QUERY_BURST),
+            OperationType.MUTATION: (MUTATION_RATE, MUTATION_BURST),
+        }
+        self.buckets = LRUCache(maxsize=max_clients)
+        self.limited = 0
+
+    def check(self, client: str, operation_type: OperationType) -> float:
+        """
+        Counts an operation of a client against its budget.
+
+        Args:
+            client (str): Key of the client.
+            operation_type (OperationType): Type of the operation.
+
+        Returns:
+            (float): 0 if allowed, else the seconds to wait before retrying.
+        """
+        if operation_type not in self.limits:
+            return 0.0
+
+        rate, burst = self.limits[operation_type]
+        now = time.monotonic()
+        key = (client, operation_type)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(burst, now)
+
+        retry_after = bucket.take(rate, burst, now)
+        if retry_after:
+            self.limited += 1
+        return retry_after
+
+
+rate_limiter = RateLimiter()
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(context) -> str:
+    """
+    Identifies the client of a request, by uid or else by IP address.
+    """
+    user = context.user
+    if user and user.get("uid"):
+        return f"uid:{user['uid']}"
+
+    request = context.request
+    if request is None or request.client is None:
+        return "ip:unknown"
+
+    # every trusted proxy appends the address it got the request from, so
+    # the client is the last address not added by one of them
+    address = request.client.host
+    forwarded = request.headers.get("x-forwarded-for", "").split(",")
+    while _is_trusted_proxy(address) and forwarded:
+        hop = forwarded.pop().strip()
+        if hop:
+            address = hop
+    return f"ip:{address}"
+
+
+class RateLimitExtension(SchemaExtension):
+    """
+    Strawberry extension rejecting operations of clients over their rate.
+    """
+
+    def on_execute(self):
+        execution_context = self.execution_context
+        retry_after = rate_limiter.check(
+            client_key(execution_context.context),
+            execution_context.operation_type,
+        )
+        if retry_after:
+            execution_context.result = ExecutionResult(
+                data=None,
+                errors=[
+                    GraphQLError(
+                        "Rate limit exceeded, retry later",
+                        extensions={
+                            "code": "RATE_LIMITED",
+                            "retryAfter": math.ceil(retry_after),
+                        },
+                    )
+                ],
+            )
+        yield
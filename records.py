@@ -0,0 +1,297 @@
+"""
+Compact Club Records.
+
+This module provides the representation in which clubs are kept in the
+in-process caches. A record is a slotted object holding only the fields
+served by the API, with the enums stored as their shared members and
+repeated strings (cids, codes, picture and social URLs) interned, so that
+records of many clubs share a single copy of them. Strawberry response
+objects are only built from a record when it is served.
+
+Records are built either from a validated `Club`, or straight from the
+documents read from the database, which were validated when written. The
+latter is used for the club lists, read restricted to `LIST_PROJECTION`, so
+that only the fields served by the lists are decoded and no `Club` is built
+for every club (see `benchmarks/decode.py`). Records are turned back into
+documents to be stored in the cache tier shared by the workers (see
+`shared_cache`), club lists being encoded by `encode_club_list`. Club
+lists are kept in `_id` order, the order in which the clubs were created,
+and cached club lists are patched with the record of a club that changed
+by `patch_club_list`, at its place in that order, rather than read again.
+
+Attributes:
+    SOCIAL_FIELDS (tuple): Social handles, in the order they are stored in.
+    LIST_PROJECTION (dict): Fields of the documents read for club lists.
+"""
+
+import sys
+from bisect import bisect
+
+import bson
+
+from models import Club, EnumCategories, EnumStates, PyObjectId
+from otypes import FullClubType, SimpleClubType, SocialsType
+
+SOCIAL_FIELDS = (
+    "website",
+    "instagram",
+    "facebook",
+    "youtube",
+    "twitter",
+    "linkedin",
+    "discord",
+    "whatsapp",
+    "other_links",
+)
+LIST_PROJECTION = {
+    field: 1
+    for field in (
+        "_id",
+        "cid",
+        "code",
+        "state",
+        "category",
+        "name",
+        "email",
+        "logo",
+        "banner",
+        "banner_square",
+        "tagline",
+        "version",
+    )
+}
+_DEFAULT_DESCRIPTION = Club.model_fields["description"].default
+
+
+def _intern(value: str | None) -> str | None:
+    """Interns a string, leaving None as it is."""
+    return None if value is None else sys.intern(value)
+
+
+class ClubRecord:
+    """
+    Compact cached representation of a club.
+
+    Attributes:
+        id (models.PyObjectId): The ID of the club's document.
+        cid (str): the Club ID.
+        code (str): Unique Short Code of Club.
+        state (models.EnumStates): State of the Club.
+        category (models.EnumCategories): Category of the Club.
+        name (str): Name of the Club.
+        email (str): Email of the Club.
+        logo (str | None): Club Logo URL.
+        banner (str | None): Club Banner URL.
+        banner_square (str | None): Club SquareBanner URL.
+        tagline (str | None): Tagline of the Club.
+        description (str | None): Club Description.
+        socials (tuple): Social handles, in the order of `SOCIAL_FIELDS`.
+        version (int): Version of the club, newer records replace older
+                       ones in the caches but never the other way around.
+    """
+
+    __slots__ = (
+        "id",
+        "cid",
+        "code",
+        "state",
+        "category",
+        "name",
+        "email",
+        "logo",
+        "banner",
+        "banner_square",
+        "tagline",
+        "description",
+        "socials",
+        "version",
+    )
+
+    def __init__(self, club: Club):
+        self.id = club.id
+        self.cid = sys.intern(club.cid)
+        self.code = sys.intern(club.code)
+        self.state = club.state
+        self.category = club.category
+        self.name = club.name
+        self.email = club.email
+        self.logo = _intern(club.logo)
+        self.banner = _intern(club.banner)
+        self.banner_square = _intern(club.banner_square)
+        self.tagline = club.tagline
+        self.description = club.description
+
+        socials = club.socials
+        self.socials = tuple(
+            _intern(getattr(socials, field)) for field in SOCIAL_FIELDS[:-1]
+        ) + (tuple(sys.intern(link) for link in socials.other_links),)
+        self.version = club.version
+
+    @classmethod
+    def from_document(cls, doc) -> "ClubRecord":
+        """
+        Builds a record straight from a club's document, without validating
+        it into a `Club`, the document having been validated when written.
+
+        Fields missing from the document take their defaults in `Club`, so
+        records built from documents restricted to `LIST_PROJECTION` are
+        only to be served as `SimpleClubType`.
+
+        Args:
+            doc (Mapping): The document of the club.
+
+        Returns:
+            (ClubRecord): The record of the club.
+        """
+        record = cls.__new__(cls)
+        record.id = doc.get("_id") or PyObjectId()
+        record.cid = sys.intern(doc["cid"])
+        record.code = sys.intern(doc["code"])
+        record.state = EnumStates(doc.get("state", EnumStates.active))
+        record.category = EnumCategories(
+            doc.get("category", EnumCategories.other)
+        )
+        record.name = doc["name"]
+        record.email = doc["email"]
+        record.logo = _intern(doc.get("logo"))
+        record.banner = _intern(doc.get("banner"))
+        record.banner_square = _intern(doc.get("banner_square"))
+        record.tagline = doc.get("tagline")
+        record.description = doc.get("description", _DEFAULT_DESCRIPTION)
+
+        socials = doc.get("socials") or {}
+        other_links = socials.get("other_links") or ()
+        record.socials = tuple(
+            _intern(socials.get(field)) for field in SOCIAL_FIELDS[:-1]
+        ) + (tuple(sys.intern(link) for link in other_links),)
+        record.version = doc.get("version", 0)
+        return record
+
+    def to_document(self) -> dict:
+        """
+        Builds the document of the club back from the record, as read by
+        `from_document`, for the record to be stored outside of the worker.
+
+        Returns:
+            (dict): The document of the club.
+        """
+        socials = dict(zip(SOCIAL_FIELDS, self.socials))
+        socials["other_links"] = list(socials["other_links"])
+        return {
+            "_id": self.id,
+            "cid": self.cid,
+            "code": self.code,
+            "state": self.state.value,
+            "category": self.category.value,
+            "name": self.name,
+            "email": self.email,
+            "logo": self.logo,
+            "banner": self.banner,
+            "banner_square": self.banner_square,
+            "tagline": self.tagline,
+            "description": self.description,
+            "socials": socials,
+            "version": self.version,
+        }
+
+    @property
+    def is_deleted(self) -> bool:
+        return self.state == EnumStates.deleted
+
+    def to_simple_type(self) -> SimpleClubType:
+        """
+        Builds the response object for the club's basic details.
+        """
+        return SimpleClubType(
+            id=self.id,
+            cid=self.cid,
+            code=self.code,
+            state=self.state,
+            category=self.category,
+            email=self.email,
+            logo=self.logo,
+            banner=self.banner,
+            banner_square=self.banner_square,
+            name=self.name,
+            tagline=self.tagline,
+            version=self.version,
+        )
+
+    def to_full_type(self) -> FullClubType:
+        """
+        Builds the response object for all the club's details.
+        """
+        socials = dict(zip(SOCIAL_FIELDS, self.socials))
+        socials["other_links"] = list(socials["other_links"])
+        return FullClubType(
+            id=self.id,
+            cid=self.cid,
+            code=self.code,
+            state=self.state,
+            category=self.category,
+            logo=self.logo,
+            banner=self.banner,
+            banner_square=self.banner_square,
+            name=self.name,
+            email=self.email,
+            tagline=self.tagline,
+            description=self.description,
+            socials=SocialsType(**socials),
+            version=self.version,
+        )
+
+
+def encode_club_list(records) -> bytes:
+    """
+    Encodes the records of a club list to BSON, restricted to the fields of
+    `LIST_PROJECTION`.
+    """
+    documents = []
+    for record in records:
+        doc = record.to_document()
+        documents.append({field: doc[field] for field in LIST_PROJECTION})
+    return bson.encode({"clubs": documents})
+
+
+def decode_club_list(data: bytes) -> tuple:
+    """Decodes the records of a club list encoded by `encode_club_list`."""
+    return tuple(
+        ClubRecord.from_document(doc) for doc in bson.decode(data)["clubs"]
+    )
+
+
+def patch_club_list(
+    records: tuple,
+    record: ClubRecord,
+    included: bool,
+    old_cid: str | None = None,
+) -> tuple:
+    """
+    Patches a club list with the details of a club that changed, replacing
+    its record, inserting it at its place in the `_id` order of the list or
+    removing it, unless the list already has a newer version of it.
+
+    Args:
+        records (tuple): The records of the list, in `_id` order.
+        record (ClubRecord): The new record of the club.
+        included (bool): Whether the club belongs to the list.
+        old_cid (str | None): The cid the club had, if it changed.
+                              Defaults to None.
+
+    Returns:
+        (tuple): The records of the patched list.
+    """
+    cids = {record.cid, old_cid or record.cid}
+    patched = []
+    for listed in records:
+        if listed.cid not in cids:
+            patched.append(listed)
+        elif listed.version > record.version:
+            return records
+    if included:
+        patched.insert(bisect(patched, record.id, key=_record_id), record)
+    return tuple(patched)
+
+
+def _record_id(record: ClubRecord):
+    return record.id
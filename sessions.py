@@ -0,0 +1,225 @@
+"""
+Causally Consistent Sessions
+
+Public queries may read from secondaries (see `db.public_clubsdb`), which
+can lag behind the primary. To never serve data older than a write this
+worker has made, every mutation runs in a causally consistent session, and
+the time of the latest write is remembered. Reads from secondaries then run
+in a causally consistent session advanced to that time, making the server
+wait until it has replicated the write before answering. The caches of the
+worker, refilled after being invalidated by a write, are thus never
+refilled with older data.
+
+Clients are not pinned to a worker, so the time of the writes of a mutation
+is also returned to the client in the `X-Operation-Time` response header.
+Sending it back in the same header with the following requests makes their
+reads wait for those writes too, whichever worker serves them, so that a
+client always sees its own writes. The header is signed with the inter
+communication secret, shared by all the workers, so that clients can't
+make reads wait for made up times; without the secret it isn't sent.
+
+The wait is bounded by the request's deadline, as every MongoDB operation
+is (see `deadline.DeadlineExtension`).
+
+Attributes:
+    OPERATION_TIME_HEADER (str): Header with the time of a client's writes.
+"""
+
+import base64
+import hashlib
+import hmac
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from os import getenv
+
+import bson
+from strawberry.extensions import SchemaExtension
+from strawberry.types.graphql import OperationType
+
+from db import client
+
+OPERATION_TIME_HEADER = "x-operation-time"
+
+_signing_key = (getenv("INTER_COMMUNICATION_SECRET") or "").encode()
+
+_current_session = ContextVar("mongo_session", default=None)
+# cluster and operation time of the latest write of the current client
+_client_write = ContextVar("client_write", default=None)
+
+# cluster and operation time of the latest write of this worker
+_last_write = {"cluster_time": None, "operation_time": None}
+
+
+def current_session():
+    """
+    Returns the session of the mutation being executed, or None outside of
+    mutations.
+    """
+    return _current_session.get()
+
+
+def _sign(data: bytes) -> bytes:
+    return hmac.new(_signing_key, data, hashlib.sha256).digest()
+
+
+def encode_write(write: dict) -> str | None:
+    """
+    Encodes and signs the cluster and operation time of a write for a
+    client, or returns None if there is no key to sign it with.
+    """
+    if not _signing_key:
+        return None
+    data = bson.encode(write)
+    return ".".join(
+        base64.urlsafe_b64encode(part).decode() for part in (data, _sign(data))
+    )
+
+
+def decode_write(token: str | None) -> dict | None:
+    """
+    Decodes the time of a write sent back by a client, or returns None if
+    the token is missing, malformed or not signed by a worker.
+    """
+    if not token or not _signing_key:
+        return None
+    try:
+        data, signature = (
+            base64.urlsafe_b64decode(part.encode())
+            for part in token.split(".")
+        )
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature, _sign(data)):
+        return None
+    try:
+        write = bson.decode(data)
+    except Exception:
+        return None
+    if not isinstance(write.get("operation_time"), bson.Timestamp):
+        return None
+    cluster_time = write.get("cluster_time")
+    if not isinstance(cluster_time, dict) or not isinstance(
+        cluster_time.get("clusterTime"), bson.Timestamp
+    ):
+        return None
+    return write
+
+
+def _latest_write() -> dict:
+    """Returns the latest of the writes of this worker and of the client."""
+    write = _client_write.get()
+    if write is None or (
+        _last_write["operation_time"] is not None
+        and _last_write["operation_time"] >= write["operation_time"]
+    ):
+        return _last_write
+    return write
+
+
+def _advance(session):
+    write = _latest_write()
+    if write["operation_time"] is not None:
+        session.advance_cluster_time(write["cluster_time"])
+        session.advance_operation_time(write["operation_time"])
+
+
+def _record_write(session):
+    operation_time = session.operation_time
+    if operation_time is None:
+        return
+    last = _last_write["operation_time"]
+    if last is None or operation_time > last:
+        _last_write["cluster_time"] = session.cluster_time
+        _last_write["operation_time"] = operation_time
+
+
+@asynccontextmanager
+async def read_session():
+    """
+    Gives the session reads from secondaries are to use: the session of the
+    current mutation if any, else a new causally consistent session
+    advanced to the latest write of this worker or of the client, or None
+    if there was no write yet.
+    """
+    session = _current_session.get()
+    if session is not None or _latest_write()["operation_time"] is None:
+        yield session
+        return
+
+    # sessions can't run operations concurrently, hence one per read
+    async with client.start_session(causal_consistency=True) as session:
+        _advance(session)
+        yield session
+
+
+def _return_write(context, session):
+    """
+    Returns the time of the writes of a mutation to the client, unless it
+    already has that of later writes (from another mutation of a batch).
+    """
+    response = getattr(context, "response", None)
+    if response is None or session.operation_time is None or not _signing_key:
+        return
+
+    returned = decode_write(response.headers.get(OPERATION_TIME_HEADER))
+    if (
+        returned is not None
+        and returned["operation_time"] >= session.operation_time
+    ):
+        return
+    response.headers[OPERATION_TIME_HEADER] = encode_write(
+        {
+            "cluster_time": session.cluster_time,
+            "operation_time": session.operation_time,
+        }
+    )
+
+
+@asynccontextmanager
+async def _mutation_session(context):
+    """
+    Runs a mutation in a causally consistent session, remembering the time
+    of its writes and returning it to the client, and forgets the lookups
+    the request shared before it.
+    """
+    # mutations are executed one field at a time, so they can share it
+    session = client.start_session(causal_consistency=True)
+    _advance(session)
+    token = _current_session.set(session)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+        _record_write(session)
+        _return_write(context, session)
+        await session.end_session()
+        # lookups shared by the operations of a batch (see
+        # `utils.shared_load`) may predate the writes, so the operations
+        # after it read again
+        loads = getattr(context, "loads", None)
+        if loads is not None:
+            loads.clear()
+
+
+class CausalSessionExtension(SchemaExtension):
+    """
+    Strawberry extension running every mutation in a causally consistent
+    session, and advancing the reads of every operation to the time of the
+    client's writes it sent back.
+    """
+
+    async def on_execute(self):
+        context = self.execution_context.context
+        request = getattr(context, "request", None)
+        headers = request.headers if request is not None else {}
+        token = _client_write.set(
+            decode_write(headers.get(OPERATION_TIME_HEADER))
+        )
+        try:
+            if self.execution_context.operation_type == OperationType.MUTATION:
+                async with _mutation_session(context):
+                    yield
+            else:
+                yield
+        finally:
+            _client_write.reset(token)
@@ -0,0 +1,437 @@
+"""
+Shared Cache Tier
+
+The in-process caches (see `cache`) belong to one worker. With several
+workers (see `WEB_CONCURRENCY` in `entrypoint.sh`), every worker would fill
+its own caches from MongoDB, and a write handled by one worker would leave
+the others serving the old details until their entries expire.
+
+This module provides a second cache tier shared by the workers, behind the
+in-process caches. It is served by Redis (or any compatible server)
+through `redis.asyncio`, this module only deciding how the tier is used:
+
+- On a miss in its own caches, a worker looks the entry up in the shared
+  tier before reading MongoDB, and stores what it read from MongoDB there,
+  so that a cache fill in one worker benefits all of them.
+- A worker invalidating an entry leaves a short-lived tombstone in its
+  place in the shared tier, and publishes the invalidation on a channel
+  every worker listens on, each dropping the entry from its own caches.
+- Entries read from MongoDB are only stored if there is no entry (or
+  tombstone) for them yet, so that a read racing with a write in another
+  worker can't replace the written details with older ones. Details just
+  written by a mutation always replace the entry.
+
+The shared tier is only a cache: if it is unreachable or slow, lookups
+miss and the workers carry on with their own caches and MongoDB, its
+circuit breaker (named "shared_cache", see `breaker`) opening after
+consecutive failures so that commands fail fast until it is back. A worker
+losing its subscription may have missed invalidations, so it empties its
+own caches once subscribed again.
+
+Attributes:
+    SHARED_CACHE_URL (str): URL of the shared tier, as
+                            `redis://[:password@]host[:port][/db]` (or
+                            `rediss://` over TLS), or
+                            `memory://` for an in-process stand-in, for
+                            tests and single worker runs. Defaults to ""
+                            (no shared tier).
+    SHARED_CACHE_PREFIX (str): Prefix of the keys and channel of the
+                               shared tier. Defaults to "clubs:".
+    SHARED_CACHE_TIMEOUT (float): Seconds a command to the shared tier is
+                                  waited for before missing. Defaults to
+                                  0.1. Its breaker is configured by
+                                  `SHARED_CACHE_BREAKER_THRESHOLD` (default
+                                  5) and
+                                  `SHARED_CACHE_BREAKER_RESET_TIMEOUT`
+                                  (seconds, default 10).
+    SHARED_CACHE_TOMBSTONE_TTL (float): Seconds the entries read from
+                                        MongoDB can't be stored for after
+                                        an invalidation. Defaults to 5.
+    shared_cache (SharedCache): The shared tier of the worker.
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import nullcontext
+from os import getenv
+from urllib.parse import urlsplit
+
+from breaker import CircuitBreaker, CircuitOpenError
+
+SHARED_CACHE_URL = getenv("SHARED_CACHE_URL", "")
+SHARED_CACHE_PREFIX = getenv("SHARED_CACHE_PREFIX", "clubs:")
+SHARED_CACHE_TIMEOUT = float(getenv("SHARED_CACHE_TIMEOUT", "0.1"))
+SHARED_CACHE_TOMBSTONE_TTL = float(getenv("SHARED_CACHE_TOMBSTONE_TTL", "5"))
+
+# value of the tombstones left by invalidations
+_TOMBSTONE = b""
+
+
+class RedisBackend:
+    """
+    Backend of the shared tier served by Redis (or any server speaking its
+    protocol), through a pool of connections of `redis.asyncio`.
+    """
+
+    def __init__(self, url: str):
+        # redis is imported only when the tier is used, keeping it out of
+        # the startup of workers without one
+        from redis.asyncio import Redis
+
+        self.client = Redis.from_url(url)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(key)
+
+    async def set(
+        self, key: str, value: bytes, ttl: float, only_if_missing=False
+    ) -> bool:
+        return bool(
+            await self.client.set(
+                key, value, px=max(1, int(ttl * 1000)), nx=only_if_missing
+            )
+        )
+
+    async def delete_prefix(self, prefix: str) -> int:
+        deleted, keys = 0, []
+        async for key in self.client.scan_iter(match=prefix + "*", count=500):
+            keys.append(key)
+            if len(keys) >= 500:
+                deleted += await self.client.delete(*keys)
+                keys = []
+        if keys:
+            deleted += await self.client.delete(*keys)
+        return deleted
+
+    async def publish(self, channel: str, message: bytes) -> int:
+        return await self.client.publish(channel, message)
+
+    async def subscribe(self, channel: str):
+        """
+        Yields the messages published on a channel, over a connection of
+        its own.
+        """
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(channel)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    yield message["data"]
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for the server of the shared tier, shared only by
+    the users of the same instance.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._subscribers = {}
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    async def set(
+        self, key: str, value: bytes, ttl: float, only_if_missing=False
+    ) -> bool:
+        if only_if_missing and await self.get(key) is not None:
+            return False
+        self._entries[key] = (value, time.monotonic() + ttl)
+        return True
+
+    async def delete_prefix(self, prefix: str) -> int:
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    async def publish(self, channel: str, message: bytes) -> int:
+        queues = self._subscribers.get(channel, ())
+        for queue in queues:
+            queue.put_nowait(message)
+        return len(queues)
+
+    async def subscribe(self, channel: str):
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].discard(queue)
+
+    async def close(self):
+        pass
+
+
+def backend_from_url(url: str) -> RedisBackend | MemoryBackend | None:
+    """
+    Returns the backend of the shared tier at the given URL, or None if no
+    URL is given.
+    """
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported shared cache URL scheme: {scheme}")
+
+
+class SharedCache:
+    """
+    Cache tier shared by the workers, keyed on the name of an in-process
+    cache and a key within it. Every method is a no-op (or a miss) if no
+    backend is configured.
+
+    Attributes:
+        backend (RedisBackend | MemoryBackend | None): Server of the tier.
+        breaker (breaker.CircuitBreaker | None): Breaker guarding the
+                                                 commands, whose timeout
+                                                 they are waited for.
+        prefix (str): Prefix of the keys and channel.
+        tombstone_ttl (float): Seconds an invalidation blocks the entries
+                               read from MongoDB from being stored.
+        source (str): Identifies the worker in the invalidations it
+                      publishes, to skip its own.
+        hits (int): Number of lookups that found an entry.
+        misses (int): Number of lookups that didn't.
+        stores (int): Number of entries stored.
+        errors (int): Number of commands that failed or timed out.
+        invalidations (int): Number of invalidations received from the
+                             other workers.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        breaker: CircuitBreaker | None = None,
+        prefix: str = "clubs:",
+        tombstone_ttl: float = 5,
+    ):
+        self.backend = backend
+        self.breaker = breaker
+        self.prefix = prefix
+        self.tombstone_ttl = tombstone_ttl
+        self.source = os.urandom(8).hex()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        self.invalidations = 0
+        self._handlers = {}
+        self._listener = None
+
+    @classmethod
+    def from_env(cls) -> "SharedCache":
+        """Creates the shared tier configured by the env variables."""
+        backend = backend_from_url(SHARED_CACHE_URL)
+        breaker = None
+        if backend is not None:
+            breaker = CircuitBreaker(
+                "shared_cache",
+                timeout=SHARED_CACHE_TIMEOUT,
+                threshold=int(getenv("SHARED_CACHE_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(
+                    getenv("SHARED_CACHE_BREAKER_RESET_TIMEOUT", "10")
+                ),
+            )
+        return cls(
+            backend,
+            breaker,
+            prefix=SHARED_CACHE_PREFIX,
+            tombstone_ttl=SHARED_CACHE_TOMBSTONE_TTL,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @property
+    def channel(self) -> str:
+        return self.prefix + "invalidations"
+
+    def _key(self, cache: str, key: str) -> str:
+        return f"{self.prefix}{cache}:{key}"
+
+    async def _call(self, command, timeout: float | None = None):
+        if timeout is None:
+            timeout = self.breaker.timeout if self.breaker else 1
+        # the tier is only a cache, so it failing is never an error
+        try:
+            async with self.breaker or nullcontext():
+                return await asyncio.wait_for(command, timeout)
+        except CircuitOpenError:
+            command.close()
+            self.errors += 1
+            return None
+        except Exception as e:
+            self.errors += 1
+            print(f"Error in the shared cache: {e!r}")
+            return None
+
+    async def get(self, cache: str, key: str) -> bytes | None:
+        """
+        Looks an entry up.
+
+        Args:
+            cache (str): Name of the in-process cache of the entry.
+            key (str): Key of the entry.
+
+        Returns:
+            (bytes | None): The entry, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        value = await self._call(self.backend.get(self._key(cache, key)))
+        if value:
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    async def fill(self, cache: str, key: str, value: bytes, ttl: float):
+        """
+        Stores an entry read from MongoDB, unless there already is one or
+        it was invalidated within `tombstone_ttl`.
+        """
+        if not self.enabled:
+            return
+        stored = await self._call(
+            self.backend.set(
+                self._key(cache, key), value, ttl, only_if_missing=True
+            )
+        )
+        if stored:
+            self.stores += 1
+
+    async def store(self, cache: str, key: str, value: bytes, ttl: float):
+        """
+        Stores an entry just written, replacing the stored one, and makes
+        the other workers drop theirs.
+        """
+        if not self.enabled:
+            return
+        if await self._call(
+            self.backend.set(self._key(cache, key), value, ttl)
+        ):
+            self.stores += 1
+        await self.broadcast(cache, key)
+
+    async def discard(self, cache: str, key: str):
+        """
+        Replaces an entry with a tombstone, the other workers keeping
+        theirs.
+        """
+        if not self.enabled:
+            return
+        await self._call(
+            self.backend.set(
+                self._key(cache, key), _TOMBSTONE, self.tombstone_ttl
+            )
+        )
+
+    async def invalidate(self, cache: str, key: str):
+        """
+        Replaces an entry with a tombstone, and makes the other workers
+        drop theirs.
+        """
+        await self.discard(cache, key)
+        await self.broadcast(cache, key)
+
+    async def clear(self, cache: str):
+        """
+        Deletes every entry of a cache, and makes the other workers empty
+        theirs.
+        """
+        if not self.enabled:
+            return
+        await self._call(
+            self.backend.delete_prefix(self._key(cache, "")), timeout=5
+        )
+        await self.broadcast(cache, None)
+
+    async def broadcast(self, cache: str, key: str | None):
+        """
+        Makes the other workers drop an entry from their in-process cache,
+        or empty it if no key is given.
+        """
+        if not self.enabled:
+            return
+        message = {"source": self.source, "cache": cache, "key": key}
+        await self._call(
+            self.backend.publish(self.channel, json.dumps(message).encode())
+        )
+
+    def on_invalidate(self, cache: str, handler):
+        """
+        Registers the coroutine function dropping an entry from an
+        in-process cache, called with its key, or with None to empty it.
+        """
+        self._handlers[cache] = handler
+
+    async def _drop_all(self):
+        for handler in self._handlers.values():
+            await handler(None)
+
+    async def _listen(self):
+        delay = 1
+        while True:
+            try:
+                async for message in self.backend.subscribe(self.channel):
+                    delay = 1
+                    message = json.loads(message)
+                    if message["source"] == self.source:
+                        continue
+                    handler = self._handlers.get(message["cache"])
+                    if handler is not None:
+                        self.invalidations += 1
+                        await handler(message["key"])
+            except Exception as e:
+                print(f"Lost the shared cache invalidations: {e!r}")
+            # invalidations may have been missed while not subscribed
+            await self._drop_all()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def start(self):
+        """Starts listening to the invalidations of the other workers."""
+        if self.enabled and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """Stops listening, and closes the connection to the backend."""
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self.enabled:
+            await self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+        }
+
+
+shared_cache = SharedCache.from_env()
@@ -0,0 +1,370 @@
+"""
+Distributed Tracing
+
+This module records OpenTelemetry-compatible spans for the work done on a
+request: one span for every GraphQL operation and root resolver, with child
+spans for every MongoDB command and every request to the gateway or the
+files microservice. Trace context is read from and passed on in the W3C
+`traceparent` header, so the spans join the traces of the gateway and the
+other subgraphs.
+
+Finished spans are handed to an exporter, chosen with `TRACE_EXPORTER`:
+`console` prints every span as a JSON line using the OpenTelemetry field
+names, `memory` keeps them in an `InMemorySpanExporter` for tests, and
+`none` (the default) disables tracing altogether.
+
+Attributes:
+    TRACE_EXPORTER (str): Exporter of the spans, one of "none", "console"
+                          and "memory". Defaults to "none".
+    TRACEPARENT_HEADER (str): Header carrying the W3C trace context.
+    SERVICE_NAME (str): Name of the service in the exported spans.
+    tracer (Tracer): Tracer of the worker.
+"""
+
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+from os import getenv
+
+from pymongo import monitoring
+from strawberry.extensions import SchemaExtension
+
+TRACE_EXPORTER = getenv("TRACE_EXPORTER", "none").lower()
+TRACEPARENT_HEADER = "traceparent"
+SERVICE_NAME = "clubs"
+
+_current_span = ContextVar("span", default=None)
+_TRACEPARENT_RE = re.compile(
+    r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$"
+)
+
+
+class Span:
+    """
+    A timed piece of work within a trace.
+
+    Attributes:
+        name (str): Name of the span.
+        kind (str): One of "server", "client" and "internal".
+        trace_id (str): Id of the trace, as 32 hex digits.
+        span_id (str): Id of the span, as 16 hex digits.
+        parent_id (str | None): Id of the parent span, if any.
+        start_time (int): Start time in ns since the epoch.
+        end_time (int | None): End time in ns since the epoch.
+        attributes (dict): Attributes of the span.
+        status (str): One of "unset", "ok" and "error".
+        error (str | None): Description of the error, if any.
+    """
+
+    __slots__ = (
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "status",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        trace_id: str,
+        parent_id: str | None = None,
+        attributes: dict | None = None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.attributes = attributes or {}
+        self.status = "unset"
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C trace context of the span, to be sent downstream."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException | str):
+        self.status = "error"
+        self.error = (
+            error
+            if isinstance(error, str)
+            else f"{type(error).__name__}: {error}"
+        )
+
+    def to_dict(self) -> dict:
+        """Returns the span with the OpenTelemetry field names."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind.upper(),
+            "startTimeUnixNano": self.start_time,
+            "endTimeUnixNano": self.end_time,
+            "attributes": self.attributes,
+            "status": {"code": self.status.upper(), "message": self.error},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class InMemorySpanExporter:
+    """
+    Exporter keeping the finished spans in memory, for tests.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def get_finished_spans(self) -> list[Span]:
+        return list(self.spans)
+
+    def clear(self):
+        self.spans.clear()
+
+
+class ConsoleSpanExporter:
+    """
+    Exporter printing every finished span as a JSON line.
+    """
+
+    def export(self, span: Span):
+        print(json.dumps(span.to_dict(), default=str))
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str] | None:
+    """
+    Parses a W3C `traceparent` header.
+
+    Returns:
+        (tuple[str, str] | None): The trace id and parent span id, or None
+                                  if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if match is None or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2)
+
+
+class Tracer:
+    """
+    Creates spans and hands the finished ones to an exporter.
+
+    Attributes:
+        exporter (InMemorySpanExporter | ConsoleSpanExporter | None):
+            Exporter of the spans, tracing is disabled if None.
+    """
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def begin(
+        self,
+        name: str,
+        kind: str = "internal",
+        attributes: dict | None = None,
+        traceparent: str | None = None,
+    ) -> Span:
+        """
+        Starts a span, child of the current span, or of the remote parent
+        in `traceparent` if given, without making it current.
+        """
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id = remote
+        elif (parent := _current_span.get()) is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+        return Span(name, kind, trace_id, parent_id, attributes)
+
+    def end(self, span: Span):
+        """Ends a span and exports it."""
+        span.end_time = time.time_ns()
+        if span.status == "unset":
+            span.status = "ok"
+        self.exporter.export(span)
+
+    @contextmanager
+    def start_span(
+        self,
+        name: str,
+        kind: str = "internal",
+        attributes: dict | None = None,
+        traceparent: str | None = None,
+    ):
+        """
+        Runs the body in a new span, made current, that records any error
+        raised. Yields None if tracing is disabled.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        span = self.begin(name, kind, attributes, traceparent)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end(span)
+
+
+def _exporter_from_env():
+    if TRACE_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    if TRACE_EXPORTER == "memory":
+        return InMemorySpanExporter()
+    return None
+
+
+tracer = Tracer(_exporter_from_env())
+
+
+def current_span() -> Span | None:
+    """Returns the span of the code being run, if any."""
+    return _current_span.get()
+
+
+def trace_headers() -> dict:
+    """
+    Returns the headers passing the current trace context on to another
+    service.
+    """
+    span = _current_span.get()
+    if span is None:
+        return {}
+    return {TRACEPARENT_HEADER: span.traceparent}
+
+
+class TracingExtension(SchemaExtension):
+    """
+    Strawberry extension recording a span for the operation and for every
+    root resolver.
+    """
+
+    def on_operation(self):
+        if not tracer.enabled:
+            yield
+            return
+
+        request = self.execution_context.context.request
+        headers = request.headers if request is not None else {}
+        with tracer.start_span(
+            "graphql.operation",
+            kind="server",
+            traceparent=headers.get(TRACEPARENT_HEADER),
+        ) as span:
+            yield
+            execution_context = self.execution_context
+            span.set_attribute(
+                "graphql.operation.name", execution_context.operation_name
+            )
+            try:
+                span.set_attribute(
+                    "graphql.operation.type",
+                    execution_context.operation_type.value,
+                )
+            except RuntimeError:
+                pass
+            result = execution_context.result
+            if result is not None and result.errors:
+                span.record_error(result.errors[0].message)
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        if not tracer.enabled or info.path.prev is not None:
+            return _next(root, info, *args, **kwargs)
+
+        name = f"{info.parent_type.name}.{info.field_name}"
+        attributes = {"graphql.field.name": info.field_name}
+        span = tracer.begin(name, attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            result = _next(root, info, *args, **kwargs)
+        except BaseException as e:
+            span.record_error(e)
+            tracer.end(span)
+            raise
+        finally:
+            _current_span.reset(token)
+
+        if isawaitable(result):
+            return self._await_in_span(result, span)
+        tracer.end(span)
+        return result
+
+    async def _await_in_span(self, result, span: Span):
+        token = _current_span.set(span)
+        try:
+            return await result
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            tracer.end(span)
+
+
+class TracingCommandListener(monitoring.CommandListener):
+    """
+    pymongo command listener recording a span for every command.
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        if not tracer.enabled:
+            return
+        attributes = {
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+        }
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            attributes["db.mongodb.collection"] = collection
+        self._spans[(event.connection_id, event.request_id)] = tracer.begin(
+            f"mongodb.{event.command_name}",
+            kind="client",
+            attributes=attributes,
+        )
+
+    def succeeded(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            tracer.end(span)
+
+    def failed(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.record_error(str(event.failure))
+            tracer.end(span)
@@ -1,26 +1,506 @@
+import asyncio
 import os
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
 
 import aiorwlock
-from cachetools import LFUCache, LRUCache
-from httpx import AsyncClient
+import bson
+from graphql import GraphQLError
+from pymongo import ReturnDocument
+
+from breaker import CircuitBreaker
+from cache import InstrumentedCache, caches
+from db import clubsdb
+from deadline import DeadlineExceeded, bounded_timeout
+from file_cleanup import FileCleanupQueue
+from metrics import observe_outbound
+from models import Club, EnumCategories, create_utc_time
+from records import (
+    LIST_PROJECTION,
+    ClubRecord,
+    encode_club_list,
+    patch_club_list,
+)
+from sessions import current_session
+from shared_cache import shared_cache
+from tracing import trace_headers, tracer
+
+# httpx is imported on the first request to another service, keeping it out
+# of the worker's startup
+if TYPE_CHECKING:
+    from httpx import Response
 
 inter_communication_secret = os.getenv("INTER_COMMUNICATION_SECRET")
-
-active_clubs_cache = LRUCache(maxsize=1)
-club_cache = LFUCache(maxsize=50)
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://gateway/graphql")
+FILES_URL = os.getenv("FILES_URL", "http://files")
+# max number of aliased operations sent to the gateway in one request
+GATEWAY_BATCH_SIZE = int(os.getenv("GATEWAY_BATCH_SIZE", "50"))
+
+# cache budgets are in bytes (approximate) and ttls in seconds
+active_clubs_cache = InstrumentedCache(
+    "active_clubs",
+    max_bytes=int(os.getenv("ACTIVE_CLUBS_CACHE_MAX_BYTES", 8 * 1024**2)),
+    ttl=float(os.getenv("ACTIVE_CLUBS_CACHE_TTL", "600")),
+)
+club_cache = InstrumentedCache(
+    "club",
+    max_bytes=int(os.getenv("CLUB_CACHE_MAX_BYTES", 16 * 1024**2)),
+    ttl=float(os.getenv("CLUB_CACHE_TTL", "600")),
+)
 active_clubs_lock = aiorwlock.RWLock()
 club_cache_lock = aiorwlock.RWLock()
 
+# the other club lists, patched like the active clubs list when a club
+# changes rather than read again: the list of all the clubs for CC ("all"),
+# and the public lists of the active clubs of every category (keyed on its
+# value)
+club_lists_cache = InstrumentedCache(
+    "club_lists",
+    max_bytes=int(os.getenv("CLUB_LISTS_CACHE_MAX_BYTES", 16 * 1024**2)),
+    ttl=float(os.getenv("CLUB_LISTS_CACHE_TTL", "600")),
+)
+club_lists_lock = aiorwlock.RWLock()
+
+# cids that were looked up but don't exist ("not found") or are deleted
+missing_club_cache = InstrumentedCache(
+    "missing_club",
+    max_bytes=int(os.getenv("MISSING_CLUB_CACHE_MAX_BYTES", 1024**2)),
+    ttl=float(os.getenv("MISSING_CLUB_CACHE_TTL", "30")),
+)
+missing_club_cache_lock = aiorwlock.RWLock()
+
+# user profiles fetched from the Users service, keyed on uid
+user_cache = InstrumentedCache(
+    "user",
+    max_bytes=int(os.getenv("USER_CACHE_MAX_BYTES", 1024**2)),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+)
+# uids for which the Users service returned no profile
+unknown_user_cache = InstrumentedCache(
+    "unknown_user",
+    max_bytes=int(os.getenv("UNKNOWN_USER_CACHE_MAX_BYTES", 256 * 1024)),
+    ttl=float(os.getenv("USER_NEGATIVE_CACHE_TTL", "60")),
+)
+user_cache_lock = aiorwlock.RWLock()
+# bumped on every invalidation of the user caches, so that a profile fetched
+# before it isn't cached after it
+_user_cache_generation = {"value": 0}
+
+gateway_breaker = CircuitBreaker.from_env("gateway")
+files_breaker = CircuitBreaker.from_env("files")
+
+
+# bumped on every invalidation of the club caches, in this worker or another
+# one, so that details read before it aren't cached after it
+_club_caches_generation = {"value": 0}
+
+
+def club_caches_generation() -> int:
+    """
+    Returns the generation of the club caches, to be given back when
+    caching what is being read.
+    """
+    return _club_caches_generation["value"]
+
+
+async def _drop_active_clubs(key=None):
+    _club_caches_generation["value"] += 1
+    async with active_clubs_lock.writer_lock:
+        active_clubs_cache.clear()
+
 
-async def invalidate_active_clubs_cache():
+async def _drop_club_lists(key=None):
+    _club_caches_generation["value"] += 1
     async with active_clubs_lock.writer_lock:
         active_clubs_cache.clear()
+    async with club_lists_lock.writer_lock:
+        club_lists_cache.clear()
+
+
+async def _patch_club_lists(record: ClubRecord, old_cid: str | None = None):
+    # reads of the lists started before the change are older than the patch
+    _club_caches_generation["value"] += 1
+    # a list the club was removed from has no version to be compared with
+    cached = club_cache[record.cid] if record.cid in club_cache else None
+    if cached is not None and cached.version > record.version:
+        return
+    async with active_clubs_lock.writer_lock:
+        if "active_clubs" in active_clubs_cache:
+            active_clubs_cache.set(
+                "active_clubs",
+                patch_club_list(
+                    active_clubs_cache["active_clubs"],
+                    record,
+                    not record.is_deleted,
+                    old_cid,
+                ),
+            )
+    async with club_lists_lock.writer_lock:
+        for key in list(club_lists_cache):
+            if key not in club_lists_cache:
+                continue
+            included = key == "all" or (
+                record.category.value == key and not record.is_deleted
+            )
+            club_lists_cache.set(
+                key,
+                patch_club_list(
+                    club_lists_cache[key], record, included, old_cid
+                ),
+            )
+
+
+async def _patch_shared_club(cid: str | None):
+    # another worker changed the club, and stored its details in the shared
+    # tier, which are cached here too, the lists being dropped if they can't
+    # be read
+    shared = None if cid is None else await shared_cache.get("club", cid)
+    if shared is None:
+        await _drop_club_lists()
+        return
+
+    record = ClubRecord.from_document(bson.decode(shared))
+    await cache_club_record(cid, record)
+    await _patch_club_lists(record)
+
+
+async def _drop_club(cid: str | None):
+    _club_caches_generation["value"] += 1
+    async with club_cache_lock.writer_lock:
+        if cid is None:
+            club_cache.clear()
+        else:
+            club_cache.pop(cid, None)
+
+
+async def _drop_missing_club(cid: str | None):
+    _club_caches_generation["value"] += 1
+    async with missing_club_cache_lock.writer_lock:
+        if cid is None:
+            missing_club_cache.clear()
+        else:
+            missing_club_cache.pop(cid, None)
+
+
+async def _drop_user(uid: str | None):
+    _user_cache_generation["value"] += 1
+    async with user_cache_lock.writer_lock:
+        if uid is None:
+            user_cache.clear()
+            unknown_user_cache.clear()
+        else:
+            user_cache.pop(uid, None)
+            unknown_user_cache.pop(uid, None)
+
+
+# invalidations published by the other workers
+shared_cache.on_invalidate("active_clubs", _drop_active_clubs)
+shared_cache.on_invalidate("club", _drop_club)
+shared_cache.on_invalidate("club_lists", _patch_shared_club)
+shared_cache.on_invalidate("missing_club", _drop_missing_club)
+shared_cache.on_invalidate("user", _drop_user)
+shared_cache.on_invalidate("unknown_user", _drop_user)
+
+
+async def invalidate_club_lists():
+    await _drop_club_lists()
+    await shared_cache.discard("active_clubs", "active_clubs")
+    await shared_cache.broadcast("club_lists", None)
 
 
 async def invalidate_club_cache(cid: str):
+    await _drop_club(cid)
+    await shared_cache.invalidate("club", cid)
+
+
+async def cache_club_record(
+    cid: str, record: ClubRecord, generation: int | None = None
+):
+    """
+    Caches the details of a club, unless a newer version of them is
+    already cached, so that a read racing with a write never replaces the
+    written details with older ones.
+
+    Args:
+        cid (str): The cid of the club.
+        record (records.ClubRecord): The details of the club.
+        generation (int | None): Generation of the club caches when the
+                                 details were read, they aren't cached if
+                                 the caches were invalidated since.
+                                 Defaults to None.
+    """
+    async with club_cache_lock.writer_lock:
+        if generation is not None and generation != club_caches_generation():
+            return
+        cached = club_cache[cid] if cid in club_cache else None
+        if cached is None or cached.version <= record.version:
+            club_cache.set(cid, record)
+
+
+async def publish_club_record(
+    cid: str, record: ClubRecord, old_cid: str | None = None
+):
+    """
+    Caches the details of a club just written, in this worker and in the
+    shared tier, the other workers dropping the details they cached, and
+    patches the club lists of every worker with them.
+
+    Args:
+        cid (str): The cid of the club.
+        record (records.ClubRecord): The details of the club.
+        old_cid (str | None): The cid the club had, if it changed.
+                              Defaults to None.
+    """
+    await cache_club_record(cid, record)
+    await shared_cache.store(
+        "club", cid, bson.encode(record.to_document()), club_cache.ttl
+    )
+
+    await _patch_club_lists(record, old_cid)
+    # every worker patches its own lists, the shared active list being
+    # read again by the workers without one
+    await shared_cache.discard("active_clubs", "active_clubs")
+    # the other workers read the details stored above
+    renamed = old_cid is not None and old_cid != cid
+    await shared_cache.broadcast("club_lists", None if renamed else cid)
+
+
+async def shared_load(context, key: tuple, load, *args) -> tuple:
+    """
+    Runs a lookup once per request, the operations of a batched request
+    (and aliased fields of an operation) sharing its result or error. The
+    lookups are forgotten once a mutation of the request is done (see
+    `sessions.CausalSessionExtension`), so that later operations see its
+    writes.
+
+    The generation of the club caches the lookup started under is returned
+    with its result, for every operation sharing it to fill the caches only
+    if they weren't invalidated since (see `club_caches_generation`).
+
+    Args:
+        context (otypes.Context): Context of the request.
+        key (tuple): Key of the lookup within the request.
+        load (Callable): Coroutine function doing the lookup.
+        *args: Arguments of `load`.
+
+    Returns:
+        (tuple): The result of the lookup, and the generation of the club
+                 caches it started under.
+    """
+    loaded = context.loads.get(key)
+    if loaded is None:
+        generation = club_caches_generation()
+        task = asyncio.ensure_future(load(*args))
+        # the error is retrieved even if every operation stops waiting
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        loaded = context.loads[key] = (task, generation)
+    task, generation = loaded
+    # an operation timing out doesn't cancel the lookup for the others
+    return await asyncio.shield(task), generation
+
+
+async def invalidate_missing_club_cache(cid: str):
+    await _drop_missing_club(cid)
+    await shared_cache.broadcast("missing_club", cid)
+
+
+async def invalidate_user_cache(uid: str):
+    await _drop_user(uid)
+    await shared_cache.broadcast("user", uid)
+
+
+async def flush_caches(names: list[str] | None = None) -> list[dict]:
+    """
+    Empties the given caches, or all of them if no names are given, in
+    every worker and in the shared tier.
+
+    Args:
+        names (list[str] | None): Names of the caches to be flushed.
+                                  Defaults to None.
+
+    Returns:
+        (list[dict]): Stats of the flushed caches.
+    """
+    flushed = []
+    for name, cache in caches.items():
+        if names is None or name in names:
+            # clear() never awaits, so no reader can see a partial state
+            cache.clear()
+            flushed.append(name)
+    _club_caches_generation["value"] += 1
+
+    for name in flushed:
+        await shared_cache.clear(name)
+    return [caches[name].stats() for name in flushed]
+
+
+async def warm_club_caches() -> int:
+    """
+    Preloads the public active clubs list, the lists of the active clubs of
+    every category and every active club's details.
+
+    Returns:
+        (int): Number of clubs loaded into the caches.
+    """
+    results = (
+        await clubsdb.find({"state": "active"})
+        .sort("_id", 1)
+        .to_list(length=None)
+    )
+
+    # the list and the per-club cache share the same records
+    records = tuple(ClubRecord.from_document(r) for r in results)
+
+    async with active_clubs_lock.writer_lock:
+        active_clubs_cache.set("active_clubs", records)
+    async with club_lists_lock.writer_lock:
+        for category in EnumCategories:
+            club_lists_cache.set(
+                category.value,
+                tuple(r for r in records if r.category == category),
+            )
     async with club_cache_lock.writer_lock:
-        if cid in club_cache:
-            del club_cache[cid]
+        for record in records:
+            club_cache.set(record.cid, record)
+
+    # the list is shared with the workers starting without it
+    await shared_cache.fill(
+        "active_clubs",
+        "active_clubs",
+        encode_club_list(records),
+        active_clubs_cache.ttl,
+    )
+
+    return len(records)
+
+
+def _listed_fields(records) -> list:
+    """The fields of `LIST_PROJECTION` of the clubs of a list, in order."""
+    fields = []
+    for record in records:
+        doc = record.to_document()
+        fields.append(tuple(doc[field] for field in LIST_PROJECTION))
+    return fields
+
+
+async def rebuild_club_lists() -> int:
+    """
+    Reads every club from the primary and replaces the cached club lists
+    with the ones built from them, as a periodic consistency check of the
+    lists patched in place, their order included. Nothing is replaced if a
+    club changed during the read, the next check replacing them.
+
+    Returns:
+        (int): Number of cached lists that differed from the ones read.
+    """
+    generation = club_caches_generation()
+    results = (
+        await clubsdb.find({}, LIST_PROJECTION)
+        .sort("_id", 1)
+        .to_list(length=None)
+    )
+    records = tuple(ClubRecord.from_document(r) for r in results)
+    active = tuple(r for r in records if not r.is_deleted)
+
+    lists = {"all": records}
+    for category in EnumCategories:
+        lists[category.value] = tuple(
+            r for r in active if r.category == category
+        )
+
+    stale = 0
+    async with active_clubs_lock.writer_lock:
+        if generation != club_caches_generation():
+            return stale
+        if "active_clubs" in active_clubs_cache and _listed_fields(
+            active_clubs_cache["active_clubs"]
+        ) != _listed_fields(active):
+            stale += 1
+        active_clubs_cache.set("active_clubs", active)
+    async with club_lists_lock.writer_lock:
+        for key, listed in lists.items():
+            if key in club_lists_cache and _listed_fields(
+                club_lists_cache[key]
+            ) != _listed_fields(listed):
+                stale += 1
+            club_lists_cache.set(key, listed)
+
+    await shared_cache.fill(
+        "active_clubs",
+        "active_clubs",
+        encode_club_list(active),
+        active_clubs_cache.ttl,
+    )
+    return stale
+
+
+@contextmanager
+def _within_deadline(timeout: float, breaker: CircuitBreaker):
+    """
+    Reports a call timing out as `DeadlineExceeded` if its timeout was cut
+    short by the request's deadline, so that it isn't held against the
+    service by its breaker.
+    """
+    from httpx import TimeoutException
+
+    try:
+        yield
+    except TimeoutException as e:
+        if timeout < breaker.timeout:
+            raise DeadlineExceeded() from e
+        raise
+
+
+async def gateway_request(
+    query: str, variables: dict, cookies=None, helper: str = "gateway"
+) -> "Response":
+    """
+    Sends a GraphQL request to the gateway
+
+    The request is guarded by the gateway's circuit breaker and uses its
+    timeout, capped by the time left for the current request. Its latency
+    and errors are recorded in the metrics under the helper's name, and it
+    is traced in a span whose context is passed on to the gateway.
+
+    Args:
+        query (str): The GraphQL query.
+        variables (dict): Variables of the query.
+        cookies (dict): Cookies from the request. Defaults to None.
+        helper (str): Name of the calling helper, for the metrics.
+                      Defaults to 'gateway'.
+
+    Returns:
+        (httpx.Response): Response from the gateway.
+
+    Raises:
+        breaker.CircuitOpenError: If the gateway is known to be down.
+        deadline.DeadlineExceeded: If the request has no time left, or ran
+                                   out of it during the call.
+        httpx.HTTPError: If the request failed, timed out or the gateway
+                         answered with a server error.
+    """
+    from httpx import AsyncClient
+
+    with tracer.start_span(
+        f"gateway {helper}",
+        kind="client",
+        attributes={"http.method": "POST", "http.url": GATEWAY_URL},
+    ):
+        async with observe_outbound("gateway", helper):
+            timeout = bounded_timeout(gateway_breaker.timeout)
+            async with gateway_breaker:
+                with _within_deadline(timeout, gateway_breaker):
+                    async with AsyncClient(
+                        cookies=cookies, timeout=timeout
+                    ) as client:
+                        response = await client.post(
+                            GATEWAY_URL,
+                            json={"query": query, "variables": variables},
+                            headers=trace_headers(),
+                        )
+                if response.is_server_error:
+                    response.raise_for_status()
+    return response
 
 
 async def update_role(uid, cookies=None, role="club") -> dict | None:
@@ -52,14 +532,94 @@ async def update_role(uid, cookies=None, role="club") -> dict | None:
                 "interCommunicationSecret": inter_communication_secret,
             }
         }
-        async with AsyncClient(cookies=cookies) as client:
-            result = await client.post(
-                "http://gateway/graphql",
-                json={"query": query, "variables": variables},
-            )
+        result = await gateway_request(
+            query, variables, cookies, helper="update_role"
+        )
         return result.json()
     except Exception:
         return None
+    finally:
+        # dropped once the profile changed, so that lookups made meanwhile
+        # can't cache the old one again (see `_user_cache_generation`)
+        await invalidate_user_cache(uid)
+
+
+def _chunks(items: list, size: int = GATEWAY_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _errored_aliases(response: dict) -> set:
+    """Returns the aliases whose field resolved with an error."""
+    return {
+        error["path"][0]
+        for error in response.get("errors") or []
+        if error.get("path")
+    }
+
+
+async def _update_roles_batch(uids, cookies, role) -> dict:
+    variables = {
+        f"r{i}": {
+            "role": role,
+            "uid": uid,
+            "interCommunicationSecret": inter_communication_secret,
+        }
+        for i, uid in enumerate(uids)
+    }
+    query = "mutation UpdateRoles({}) {{ {} }}".format(
+        ", ".join(f"${alias}: RoleInput!" for alias in variables),
+        " ".join(
+            f"{alias}: updateRole(roleInput: ${alias})" for alias in variables
+        ),
+    )
+    try:
+        result = await gateway_request(
+            query, variables, cookies, helper="update_roles"
+        )
+        response = result.json()
+        data = response.get("data") or {}
+        errored = _errored_aliases(response)
+    except Exception:
+        return {uid: False for uid in uids}
+
+    return {
+        uid: f"r{i}" in data and f"r{i}" not in errored
+        for i, uid in enumerate(uids)
+    }
+
+
+async def update_roles(uids, cookies=None, role="club") -> dict:
+    """
+    Function to call the updateRole mutation for many users at once
+
+    Sends the `updateRole` mutations of up to `GATEWAY_BATCH_SIZE` users as
+    aliased fields of a single request, the batches being sent concurrently.
+
+    Args:
+        uids (list[str]): User IDs.
+        cookies (dict): Cookies from the request. Defaults to None.
+        role (str): Role of the users to be updated to. Defaults to 'club'.
+
+    Returns:
+        (dict): Whether the role of each uid was updated, keyed on uid.
+    """
+    uids = list(dict.fromkeys(uids))
+
+    results = {}
+    try:
+        for batch in await asyncio.gather(
+            *(
+                _update_roles_batch(chunk, cookies, role)
+                for chunk in _chunks(uids)
+            )
+        ):
+            results.update(batch)
+    finally:
+        # dropped once the profiles changed, as in `update_role`
+        for uid in uids:
+            await invalidate_user_cache(uid)
+    return results
 
 
 async def update_events_members_cid(old_cid, new_cid, cookies=None) -> bool:
@@ -102,11 +662,9 @@ async def update_events_members_cid(old_cid, new_cid, cookies=None) -> bool:
             "newCid": new_cid,
             "interCommunicationSecret": inter_communication_secret,
         }
-        async with AsyncClient(cookies=cookies) as client:
-            result = await client.post(
-                "http://gateway/graphql",
-                json={"query": query, "variables": variables},
-            )
+        result = await gateway_request(
+            query, variables, cookies, helper="update_events_members_cid"
+        )
         return1 = result.json()
     except Exception:
         return False
@@ -131,11 +689,9 @@ async def update_events_members_cid(old_cid, new_cid, cookies=None) -> bool:
             "newCid": new_cid,
             "interCommunicationSecret": inter_communication_secret,
         }
-        async with AsyncClient(cookies=cookies) as client:
-            result = await client.post(
-                "http://gateway/graphql",
-                json={"query": query, "variables": variables},
-            )
+        result = await gateway_request(
+            query, variables, cookies, helper="update_events_members_cid"
+        )
         return2 = result.json()
     except Exception:
         return False
@@ -153,6 +709,10 @@ async def getUser(uid, cookies=None) -> dict | None:
     Makes a query resolved by the `userProfile` method from Users Microservice.
     Used to get a users details.
 
+    Note: Profiles are cached for `USER_CACHE_TTL` seconds, and uids without
+    a profile are cached for `USER_NEGATIVE_CACHE_TTL` seconds. Failed
+    requests are never cached.
+
     Args:
         uid (str): User ID of the user to be fetched.
         cookies (dict): Cookies from the request. Defaults to None.
@@ -160,6 +720,14 @@ async def getUser(uid, cookies=None) -> dict | None:
     Returns:
         (dict | None): User details as a result of the query.
     """
+    async with user_cache_lock.reader_lock:
+        profile = user_cache.get(uid)
+        if profile is not None:
+            return profile
+        if unknown_user_cache.get(uid):
+            return None
+
+    generation = _user_cache_generation["value"]
     try:
         query = """
             query GetUserProfile($userInput: UserInput!) {
@@ -172,45 +740,255 @@ async def getUser(uid, cookies=None) -> dict | None:
             }
         """
         variable = {"userInput": {"uid": uid}}
-        async with AsyncClient(cookies=cookies) as client:
-            request = await client.post(
-                "http://gateway/graphql",
-                json={"query": query, "variables": variable},
-            )
-        return request.json()["data"]["userProfile"]
+        request = await gateway_request(
+            query, variable, cookies, helper="getUser"
+        )
+        profile = request.json()["data"]["userProfile"]
     except Exception:
         return None
 
+    # cached unless the user was invalidated since the lookup
+    async with user_cache_lock.writer_lock:
+        if generation == _user_cache_generation["value"]:
+            if profile is None:
+                unknown_user_cache.set(uid, True)
+            else:
+                user_cache.set(uid, profile)
+
+    return profile
+
+
+async def _get_users_batch(uids, cookies) -> dict:
+    variables = {f"u{i}": {"uid": uid} for i, uid in enumerate(uids)}
+    query = "query GetUserProfiles({}) {{ {} }}".format(
+        ", ".join(f"${alias}: UserInput!" for alias in variables),
+        " ".join(
+            f"{alias}: userProfile(userInput: ${alias}) "
+            "{ firstName lastName email rollno }"
+            for alias in variables
+        ),
+    )
+    generation = _user_cache_generation["value"]
+    try:
+        request = await gateway_request(
+            query, variables, cookies, helper="getUsers"
+        )
+        response = request.json()
+        data = response["data"]
+        errored = _errored_aliases(response)
+    except Exception:
+        return {uid: None for uid in uids}
+
+    profiles = {}
+    async with user_cache_lock.writer_lock:
+        stale = generation != _user_cache_generation["value"]
+        for i, uid in enumerate(uids):
+            profile = data.get(f"u{i}")
+            profiles[uid] = profile
+            if stale:
+                continue
+            if profile is not None:
+                user_cache.set(uid, profile)
+            elif f"u{i}" not in errored:
+                unknown_user_cache.set(uid, True)
+    return profiles
+
+
+async def getUsers(uids, cookies=None) -> dict:
+    """
+    Function to get the details of many users at once
+
+    Serves what it can from the user caches, and fetches the rest with
+    `userProfile` queries sent as aliased fields of as few requests as
+    possible, the requests being sent concurrently.
+
+    Args:
+        uids (list[str]): User IDs of the users to be fetched.
+        cookies (dict): Cookies from the request. Defaults to None.
 
-async def delete_file(filename) -> str:
+    Returns:
+        (dict): User details (or None if not found) keyed on uid.
+    """
+    profiles = {}
+    missing = []
+    async with user_cache_lock.reader_lock:
+        for uid in dict.fromkeys(uids):
+            profile = user_cache.get(uid)
+            if profile is not None:
+                profiles[uid] = profile
+            elif unknown_user_cache.get(uid):
+                profiles[uid] = None
+            else:
+                missing.append(uid)
+
+    for batch in await asyncio.gather(
+        *(_get_users_batch(chunk, cookies) for chunk in _chunks(missing))
+    ):
+        profiles.update(batch)
+    return profiles
+
+
+async def delete_file(filename, client=None) -> str:
     """
     Method for deleting a file from the files microservice
 
     Args:
         filename (str): Name of the file to be deleted
+        client (httpx.AsyncClient): Client to send the request with, a new
+                                    one is used if not given. Defaults to
+                                    None.
 
     Returns:
         (str): Response from the files microservice
-    """
-    async with AsyncClient() as client:
-        response = await client.post(
-            "http://files/delete-file",
-            params={
-                "filename": filename,
-                "inter_communication_secret": inter_communication_secret,
-            },
-        )
 
-    if response.status_code != 200:
-        raise Exception(response.text)
+    Raises:
+        breaker.CircuitOpenError: If the files microservice is known to be
+                                  down.
+        Exception: If the file could not be deleted.
+    """
+    params = {
+        "filename": filename,
+        "inter_communication_secret": inter_communication_secret,
+    }
+    url = f"{FILES_URL}/delete-file"
+    if client is None:
+        from httpx import AsyncClient
+
+    with tracer.start_span(
+        "files delete_file",
+        kind="client",
+        attributes={"http.method": "POST", "http.url": url},
+    ):
+        async with observe_outbound("files", "delete_file"):
+            timeout = bounded_timeout(files_breaker.timeout)
+            async with files_breaker:
+                with _within_deadline(timeout, files_breaker):
+                    if client is None:
+                        async with AsyncClient(timeout=timeout) as client:
+                            response = await client.post(
+                                url, params=params, headers=trace_headers()
+                            )
+                    else:
+                        response = await client.post(
+                            url,
+                            params=params,
+                            headers=trace_headers(),
+                            timeout=timeout,
+                        )
+                if response.is_server_error:
+                    response.raise_for_status()
+
+            if response.status_code != 200:
+                raise Exception(response.text)
 
     return response.text
 
 
+file_cleanup_queue = FileCleanupQueue(delete_file)
+
+
+def version_conflict(cid: str) -> GraphQLError:
+    """
+    Error raised when a club was changed by another write since the version
+    a change is based on.
+    """
+    return GraphQLError(
+        f"The club {cid} was changed by someone else, reload it and retry",
+        extensions={"code": "VERSION_CONFLICT"},
+    )
+
+
+def version_query(version: int) -> dict | int:
+    """
+    Query matching a club's version, clubs written before versions were
+    added having none, which counts as version 0.
+    """
+    return version if version else {"$in": [0, None]}
+
+
+async def replace_club(
+    exists: dict, club_input: dict, version: int | None = None
+) -> Club:
+    """
+    Replaces a club by its edited details, only if it wasn't changed since
+    it was read, by comparing and swapping its version.
+
+    Args:
+        exists (dict): The club as read before being edited.
+        club_input (dict): The edited details of the club.
+        version (int | None): Version of the club the edit is based on, if
+                              known to the client. Defaults to None.
+
+    Returns:
+        (models.Club): The club as written.
+
+    Raises:
+        GraphQLError: The club was changed by someone else.
+    """
+    current = exists.get("version", 0)
+    if version is not None and version != current:
+        raise version_conflict(exists["cid"])
+
+    club_input["created_time"] = exists["created_time"]
+    club_input["updated_time"] = create_utc_time()
+    club_input["version"] = current + 1
+
+    result = await clubsdb.replace_one(
+        {"_id": exists["_id"], "version": version_query(current)},
+        club_input,
+        session=current_session(),
+    )
+    if result.matched_count == 0:
+        raise version_conflict(exists["cid"])
+
+    return Club.model_validate(club_input)
+
+
+async def update_club(cid: str, update: dict, version: int | None = None):
+    """
+    Updates a club and increments its version, only if it is still at the
+    given version if one is given.
+
+    Args:
+        cid (str): The Club ID.
+        update (dict): Fields of the club to be set.
+        version (int | None): Version of the club the update is based on.
+                              Defaults to None.
+
+    Returns:
+        (models.Club): The updated club.
+
+    Raises:
+        Exception: A club with this cid doesn't exist.
+        GraphQLError: The club was changed by someone else.
+    """
+    query = {"cid": cid}
+    if version is not None:
+        query["version"] = version_query(version)
+
+    updated = await clubsdb.find_one_and_update(
+        query,
+        {"$set": update, "$inc": {"version": 1}},
+        return_document=ReturnDocument.AFTER,
+        session=current_session(),
+    )
+    if updated is None:
+        if version is not None and await clubsdb.find_one(
+            {"cid": cid}, {"_id": 1}, session=current_session()
+        ):
+            raise version_conflict(cid)
+        raise Exception("A club with this cid doesn't exist")
+
+    return Club.model_validate(updated)
+
+
 async def check_remove_old_file(old_obj, new_obj, name="logo") -> bool:
     """
     Method to remove old files.
 
+    The old file is queued for deletion in the background, see
+    `file_cleanup.FileCleanupQueue`.
+
     Args:
         old_obj (dict): Old object containing the old file
         new_obj (dict): New object containing the new file
@@ -218,16 +996,13 @@ async def check_remove_old_file(old_obj, new_obj, name="logo") -> bool:
                     mostly they are images of club logo's.
 
     Returns:
-        (bool): True if the old file is removed, False otherwise
+        (bool): True if the old file is queued for removal or there is
+                nothing to remove
     """
     old_file = old_obj.get(name)
     new_file = new_obj.get(name)
 
     if old_file and new_file and old_file != new_file:
-        try:
-            await delete_file(old_file)
-        except Exception as e:
-            print(f"Error in deleting old {name} file: {e}")
-            return False
+        file_cleanup_queue.enqueue(old_file)
 
     return True